@@ -0,0 +1,191 @@
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import random
+from typing import Iterator
+
+try:
+    from .dodecagon_solver import BOARD_SIZE, EDGE_SLOTS, get_neighbors, get_wheel_at_position
+except ImportError:
+    # Run as a script from inside the dodecagon_solver folder
+    from dodecagon_solver import BOARD_SIZE, EDGE_SLOTS, get_neighbors, get_wheel_at_position
+
+# Searches for new Dodecagon wheel sets that have exactly a chosen number of solutions
+# Solutions that are the whole board turned 180 degrees are counted once,
+# since every solution can be turned that way to give another one
+
+WHEEL_IDS = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J', 'K', 'L']
+WHEEL_SIZE = 12
+# Candidates waiting in or running on the pool at any time, for each worker process
+DESIGN_TASKS_PER_PROCESS = 4
+
+# Counts the solutions of a wheel set up to 180 degree rotation, stopping once limit is reached
+# The solver finds twice as many, since it also lists each solution turned round
+# Works with lookup tables instead of constraint objects, which makes it fast enough to run on many designs
+# Limit None counts every solution
+
+
+def count_solutions(wheel_config: dict[str, list[int]], limit: int | None = 2) -> int:
+    wheel_ids = list(wheel_config.keys())
+    wheel_count = len(wheel_ids)
+    wheel_size = len(wheel_config[wheel_ids[0]])
+    # Numbers at 12, 3, 6 and 9 o'clock for each wheel in each orientation
+    edges = [[[get_wheel_at_position(wheel_config, wheel_id, orientation)[slot] for slot in EDGE_SLOTS]
+              for orientation in range(0, wheel_size)] for wheel_id in wheel_ids]
+    # For each wheel and number, the orientations that put that number at 12 o'clock
+    top_orientations: list[dict[int, list[int]]] = []
+    for wheel_edges in edges:
+        by_top: dict[int, list[int]] = {}
+        for orientation, orientation_edges in enumerate(wheel_edges):
+            by_top.setdefault(orientation_edges[0], []).append(orientation)
+        top_orientations.append(by_top)
+    ups = [get_neighbors(position)['Up'] for position in range(0, BOARD_SIZE)]
+    lefts = [get_neighbors(position)['Lt'] for position in range(0, BOARD_SIZE)]
+
+    # Number showing at 6 o'clock and 3 o'clock for each placed position
+    bottoms = [0] * BOARD_SIZE
+    rights = [0] * BOARD_SIZE
+    placed = [0] * BOARD_SIZE
+    count = 0
+    all_orientations = list(range(0, wheel_size))
+
+    # Fills positions in order, so the wheels above and to the left are always placed
+    def place(position: int, available: int) -> bool:
+        nonlocal count
+        if position == BOARD_SIZE:
+            count += 1
+            return limit is not None and count >= limit
+        up = None if ups[position] is None else bottoms[ups[position]]
+        left = None if lefts[position] is None else rights[lefts[position]]
+        for wheel in range(0, wheel_count):
+            if not available & (1 << wheel):
+                continue
+            # Count each 180 degree pair once by keeping the lower wheel in the top left
+            if position == BOARD_SIZE - 1 and wheel < placed[0]:
+                continue
+            if up is None:
+                orientations = all_orientations
+            else:
+                orientations = top_orientations[wheel].get(up, [])
+            for orientation in orientations:
+                orientation_edges = edges[wheel][orientation]
+                if left is not None and orientation_edges[3] != left:
+                    continue
+                placed[position] = wheel
+                bottoms[position] = orientation_edges[2]
+                rights[position] = orientation_edges[1]
+                if place(position + 1, available & ~(1 << wheel)):
+                    return True
+        return False
+
+    place(0, (1 << wheel_count) - 1)
+    return count
+
+# Returns the rotation of a wheel that comes first in sort order
+
+
+def canonical_wheel(wheel_config: dict[str, list[int]], wheel_id: str) -> tuple[int, ...]:
+    return min(tuple(get_wheel_at_position(wheel_config, wheel_id, orientation))
+               for orientation in range(0, len(wheel_config[wheel_id])))
+
+# Returns a key that is the same for wheel sets that only differ by
+# wheel labels, wheel rotations, or reading every wheel the other way round (a mirrored board)
+# Used to compare designs, for example to spot the same wheel set in two output files
+
+
+def canonical_key(wheel_config: dict[str, list[int]]) -> tuple[tuple[int, ...], ...]:
+    mirrored_config = {wheel_id: [wheel[0]] + list(reversed(wheel[1:]))
+                       for wheel_id, wheel in wheel_config.items()}
+    key = tuple(sorted(canonical_wheel(wheel_config, wheel_id)
+                for wheel_id in wheel_config))
+    mirrored_key = tuple(sorted(canonical_wheel(mirrored_config, wheel_id)
+                         for wheel_id in mirrored_config))
+    return min(key, mirrored_key)
+
+# Makes a random wheel set
+# Each wheel gets distinct numbers drawn from 1 to max_number, with the lowest number at 12 o'clock
+# With max_number 12 random sets usually have thousands of solutions, so larger ranges are needed for few solutions
+
+
+def random_wheel_config(rng: random.Random, max_number: int = 18) -> dict[str, list[int]]:
+    wheel_config: dict[str, list[int]] = {}
+    for wheel_id in WHEEL_IDS:
+        numbers = rng.sample(range(1, max_number + 1), WHEEL_SIZE)
+        lowest = numbers.index(min(numbers))
+        wheel_config[wheel_id] = numbers[lowest:] + numbers[:lowest]
+    return wheel_config
+
+# Yields random wheel sets
+# Repeats are not filtered out: each wheel alone has at least 11! orderings, so drawing the same
+# wheel set twice is practically impossible, and remembering every key would grow without limit on long runs
+
+
+def generate_candidates(seed: int, max_number: int = 18) -> Iterator[dict[str, list[int]]]:
+    rng = random.Random(seed)
+    while True:
+        yield random_wheel_config(rng, max_number)
+
+# Counts one design for the worker pool, stopping one past the target
+
+
+def _evaluate_candidate(arguments: tuple[dict[str, list[int]], int]) -> tuple[dict[str, list[int]], int]:
+    wheel_config, target = arguments
+    return wheel_config, count_solutions(wheel_config, target + 1)
+
+# Checks candidate designs in parallel and appends those with exactly target solutions to output_path
+# Each accepted design is written as one JSON line as soon as it is found
+# Its solution count is up to 180 degree rotation, so the solver finds twice as many
+# Returns the accepted designs
+
+
+def design(output_path: str, candidates: int, target: int = 1, seed: int = 0, max_number: int = 18, processes: int | None = None) -> list[dict[str, list[int]]]:
+    if target < 1:
+        raise ValueError("Target must be at least one solution")
+    accepted: list[dict[str, list[int]]] = []
+    generator = generate_candidates(seed, max_number)
+    # A fixed number of candidates is kept in flight and topped up as each result arrives,
+    # so memory use stays flat and one slow count does not leave the other workers idle
+    window = DESIGN_TASKS_PER_PROCESS * (processes or os.cpu_count() or 1)
+    finished: queue.Queue = queue.Queue()
+    submitted = 0
+    pending = 0
+    with multiprocessing.Pool(processes) as pool, open(output_path, 'a') as output_file:
+        while submitted < candidates or pending > 0:
+            while submitted < candidates and pending < window:
+                pool.apply_async(_evaluate_candidate, ((next(generator), target),),
+                                 callback=finished.put, error_callback=finished.put)
+                submitted += 1
+                pending += 1
+            result = finished.get()
+            pending -= 1
+            if isinstance(result, BaseException):
+                raise result
+            wheel_config, count = result
+            if count == target:
+                accepted.append(wheel_config)
+                output_file.write(json.dumps(
+                    {'solutions_up_to_rotation': count, 'wheel_config': wheel_config}) + '\n')
+                output_file.flush()
+    return accepted
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description='Search for Dodecagon wheel sets with an exact number of solutions')
+    parser.add_argument('output', help='file to append accepted designs to')
+    parser.add_argument('--candidates', type=int, default=1000,
+                        help='number of wheel sets to try')
+    parser.add_argument('--target', type=int, default=1,
+                        help='number of solutions a design must have')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-number', type=int, default=18,
+                        help='highest number that can appear on a wheel')
+    parser.add_argument('--processes', type=int, default=None)
+    args = parser.parse_args()
+
+    designs = design(args.output, args.candidates, args.target,
+                     args.seed, args.max_number, args.processes)
+    print(f'Accepted {len(designs)} of {args.candidates} designs')
@@ -1,4 +1,13 @@
 from abc import ABC, abstractmethod
+import hashlib
+import json
+import mmap
+import multiprocessing
+import os
+import struct
+import queue
+import random
+import time
 from typing import TypeAlias, TypedDict
 
 
@@ -20,26 +29,296 @@ WheelConfiguration = TypedDict('WheelConfiguration', {
     'K': list[int],
     'L': list[int]
 })
+# Describes how a search should be run
+# Ordering picks the next position: 'first' or 'last' unassigned, or 'mrv' (fewest wheels left)
+# Value_ordering is 'ascending' or 'descending' through the wheel choices
+# Seed turns on random tie-breaking, so the same seed always gives the same search
+# Restarts is 'none', 'luby' or 'geometric' and needs a seed
+# Restart_base is the number of failures allowed before the first restart
+# Restart_factor is how much the failure limit grows per restart under 'geometric'
+SearchConfiguration = TypedDict('SearchConfiguration', {
+    'name': str,
+    'ordering': str,
+    'value_ordering': str,
+    'seed': int,
+    'restarts': str,
+    'restart_base': int,
+    'restart_factor': float
+}, total=False)
+
+# Configurations raced by CSP.portfolio_search when none are given
+DEFAULT_PORTFOLIO: list[SearchConfiguration] = [
+    {'name': 'first', 'ordering': 'first'},
+    {'name': 'last', 'ordering': 'last'},
+    {'name': 'mrv', 'ordering': 'mrv'},
+    {'name': 'first-descending', 'ordering': 'first',
+        'value_ordering': 'descending'},
+    {'name': 'mrv-luby', 'ordering': 'mrv', 'seed': 1, 'restarts': 'luby'},
+]
+
+# Raises ValueError if a search configuration has an unknown setting or one that cannot finish
+
+
+def check_configuration(configuration: SearchConfiguration) -> None:
+    ordering = configuration.get('ordering', 'first')
+    if ordering not in ['first', 'last', 'mrv']:
+        raise ValueError(f"Unknown ordering '{ordering}'")
+    value_ordering = configuration.get('value_ordering', 'ascending')
+    if value_ordering not in ['ascending', 'descending']:
+        raise ValueError(f"Unknown value ordering '{value_ordering}'")
+    restarts = configuration.get('restarts', 'none')
+    if restarts not in ['none', 'luby', 'geometric']:
+        raise ValueError(f"Unknown restart policy '{restarts}'")
+    if restarts != 'none' and configuration.get('seed') is None:
+        raise ValueError("Restarts need a seed to vary the search")
+    # The failure limit has to keep growing, or a hard puzzle restarts forever
+    if configuration.get('restart_base', 100) < 1:
+        raise ValueError("Restart base must be at least 1")
+    if configuration.get('restart_factor', 1.5) <= 1:
+        raise ValueError("Restart factor must be greater than 1")
+
+# Returns the i-th term (starting at 1) of the Luby sequence: 1, 1, 2, 1, 1, 2, 4, 1, ...
+
+
+def luby(i: int) -> int:
+    k = 1
+    while (1 << k) - 1 < i:
+        k += 1
+    if i == (1 << k) - 1:
+        return 1 << (k - 1)
+    return luby(i - (1 << (k - 1)) + 1)
+
+# Raised inside the search when the failure limit for the current run is reached
+
+
+class RestartSearch(Exception):
+    pass
+
+# Saved progress of an exhaustive search
+# Path is the list of (position, (wheel id, orientation)) choices leading to the node the search was working on
+# Digest is a fingerprint of the puzzle (domains and constraints), see CSP.get_digest
+# Done is set once the whole search has finished
+
+
+CHECKPOINT_VERSION = 2
+Checkpoint = TypedDict('Checkpoint', {
+    'version': int,
+    'digest': str,
+    'ordering': str,
+    'value_ordering': str,
+    'assignment': dict[int, tuple[str, int]],
+    'path': list[tuple[int, tuple[str, int]]],
+    'solutions': list[dict[int, tuple[str, int]]],
+    'done': bool
+})
+
+# Writes a checkpoint as JSON
+# The file is replaced in one step, so a crash mid-write leaves the previous checkpoint intact
+
+
+def save_checkpoint(checkpoint_path: str, checkpoint: Checkpoint) -> None:
+    # Each process writes its own temporary file, so two jobs never write into the same one
+    temporary_path = f'{checkpoint_path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'w') as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+    os.replace(temporary_path, checkpoint_path)
+
+# Reads a checkpoint back, restoring the integer keys and tuples JSON turns into strings and lists
+
+
+def load_checkpoint(checkpoint_path: str) -> Checkpoint:
+    with open(checkpoint_path) as checkpoint_file:
+        data = json.load(checkpoint_file)
+    if data.get('version') != CHECKPOINT_VERSION:
+        raise ValueError(
+            f"Checkpoint version {data.get('version')} is not supported")
+    return {
+        'version': data['version'],
+        'digest': data['digest'],
+        'ordering': data['ordering'],
+        'value_ordering': data['value_ordering'],
+        'assignment': {int(key): (value[0], value[1]) for key, value in data['assignment'].items()},
+        'path': [(position, (value[0], value[1])) for position, value in data['path']],
+        'solutions': [{int(key): (value[0], value[1]) for key, value in solution.items()}
+                      for solution in data['solutions']],
+        'done': data['done']
+    }
 
 # Rotates wheels and returns contents of the wheel in the new order
 
 
 def get_wheel_at_position(wheel_config: WheelConfiguration, wheel_id: str, position: int) -> list[int]:
-    wheel_ids = []
-    for id in wheel_config:
-        wheel_ids.append(id)
-    wheel_size = len(wheel_config[wheel_ids[0]])
+    wheel = wheel_config[wheel_id]
 
     if position == 0:
-        return wheel_config[wheel_id]
+        return wheel
     else:
-        rotated = []
-        for idx in range(wheel_size - position, wheel_size):
-            rotated.append(wheel_config[wheel_id][idx])
-        for idx in range(0, wheel_size - position):
-            rotated.append(wheel_config[wheel_id][idx])
+        # The last `position` numbers move round to the top of the wheel
+        return wheel[-position:] + wheel[:-position]
+
+# The board is 3 rows of 4 wheels, with positions numbered along each row
+
+
+BOARD_WIDTH = 4
+BOARD_SIZE = 12
+
+# Returns the positions above, below, left and right of a position, or None where the board ends
+
+
+def get_neighbors(position: int) -> dict[str, int | None]:
+    return {
+        'Up': position - BOARD_WIDTH if position >= BOARD_WIDTH else None,
+        'Dn': position + BOARD_WIDTH if position + BOARD_WIDTH < BOARD_SIZE else None,
+        'Lt': position - 1 if position % BOARD_WIDTH != 0 else None,
+        'Rt': position + 1 if position % BOARD_WIDTH != BOARD_WIDTH - 1 else None
+    }
+
+# Precompiled model of a wheel set, shared by worker processes through an on-disk cache
+# The model holds the numbers at 12, 3, 6 and 9 o'clock for every wheel in every orientation,
+# which are the only numbers NeighborConstraint compares
+# The cache file is a short header followed by one flat byte table, so it can be memory-mapped as is
+
+
+MODEL_MAGIC = b'DDGM'
+MODEL_VERSION = 1
+MODEL_HEADER = struct.Struct('<4sHI')
+EDGE_SLOTS = [0, 3, 6, 9]
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.expanduser('~'), '.cache', 'puzzle_solvers')
+
+
+class WheelModel:
+
+    def __init__(self, wheel_ids: WheelChoices, wheel_size: int, digest: str, edges: bytes | memoryview):
+        self.wheel_ids = wheel_ids
+        self.wheel_size = wheel_size
+        self.digest = digest
+        self.edges = edges
+        self.wheel_index: dict[str, int] = {}
+        for idx, wheel_id in enumerate(wheel_ids):
+            self.wheel_index[wheel_id] = idx
+        # Keeps the memory map open for as long as the model is in use
+        self.mapping: mmap.mmap | None = None
+
+    # Releases the memory map, after which the model can no longer be used
+    def close(self) -> None:
+        if self.mapping is not None:
+            if isinstance(self.edges, memoryview):
+                self.edges.release()
+            self.mapping.close()
+            self.mapping = None
+
+    # Memory maps cannot be pickled, so models sent to other processes carry a copy of the table
+    def __reduce__(self):
+        return (WheelModel, (self.wheel_ids, self.wheel_size, self.digest, bytes(self.edges)))
+
+    # Returns the numbers at 12, 3, 6 and 9 o'clock for a wheel in an orientation
+    # The numbers are copied out, so no view into the memory map outlives close()
+    def get_edges(self, wheel_id: str, orientation: int) -> bytes:
+        start = (self.wheel_index[wheel_id] *
+                 self.wheel_size + orientation) * len(EDGE_SLOTS)
+        return bytes(self.edges[start:start + len(EDGE_SLOTS)])
+
+# Returns a fingerprint of a wheel set, used to match cache files to wheel sets
+
+
+def get_config_digest(wheel_config: WheelConfiguration) -> str:
+    contents = json.dumps(wheel_config, sort_keys=True).encode()
+    return hashlib.sha256(contents).hexdigest()
+
+# Compiles a wheel set into the bytes of a cache file
 
-        return rotated
+
+def build_model(wheel_config: WheelConfiguration) -> bytes:
+    wheel_ids = list(wheel_config.keys())
+    wheel_size = len(wheel_config[wheel_ids[0]])
+    edges = bytearray()
+    for wheel_id in wheel_ids:
+        if max(wheel_config[wheel_id]) > 255 or min(wheel_config[wheel_id]) < 0:
+            raise ValueError("Wheel numbers must be between 0 and 255")
+        for orientation in range(0, wheel_size):
+            rotated = get_wheel_at_position(
+                wheel_config, wheel_id, orientation)
+            edges.extend(rotated[slot] for slot in EDGE_SLOTS)
+    metadata = json.dumps({
+        'wheel_ids': wheel_ids,
+        'wheel_size': wheel_size,
+        'digest': get_config_digest(wheel_config)
+    }).encode()
+    return MODEL_HEADER.pack(MODEL_MAGIC, MODEL_VERSION, len(metadata)) + metadata + bytes(edges)
+
+# Reads a model from the bytes of a cache file without copying the table
+
+
+def parse_model(buffer: bytes | mmap.mmap) -> WheelModel:
+    if len(buffer) < MODEL_HEADER.size:
+        raise ValueError("Model file is too short")
+    magic, version, metadata_length = MODEL_HEADER.unpack_from(buffer, 0)
+    if magic != MODEL_MAGIC:
+        raise ValueError("Not a wheel model file")
+    if version != MODEL_VERSION:
+        raise ValueError(f"Model version {version} is not supported")
+    metadata_end = MODEL_HEADER.size + metadata_length
+    metadata = json.loads(bytes(buffer[MODEL_HEADER.size:metadata_end]))
+    try:
+        wheel_ids = metadata['wheel_ids']
+        wheel_size = metadata['wheel_size']
+        digest = metadata['digest']
+    except (KeyError, TypeError) as error:
+        raise ValueError("Model file has damaged metadata") from error
+    # Checked before taking a view, so a bad file leaves nothing pointing into the buffer
+    if len(buffer) - metadata_end != len(wheel_ids) * wheel_size * len(EDGE_SLOTS):
+        raise ValueError("Model file is truncated")
+    return WheelModel(wheel_ids, wheel_size, digest, memoryview(buffer)[metadata_end:])
+
+# Writes the compiled model of a wheel set to a cache file
+# The file is replaced in one step, so readers never see a half written model
+
+
+def save_model(model_path: str, wheel_config: WheelConfiguration) -> None:
+    temporary_path = f'{model_path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'wb') as model_file:
+        model_file.write(build_model(wheel_config))
+        model_file.flush()
+        os.fsync(model_file.fileno())
+    os.replace(temporary_path, model_path)
+
+# Memory-maps a cache file and returns its model
+
+
+def load_model(model_path: str) -> WheelModel:
+    with open(model_path, 'rb') as model_file:
+        mapping = mmap.mmap(model_file.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        model = parse_model(mapping)
+    except ValueError:
+        mapping.close()
+        raise
+    model.mapping = mapping
+    return model
+
+# Returns the model of a wheel set from the cache, compiling and storing it first if needed
+# A cache file that is empty, damaged or for another wheel set is rebuilt
+
+
+def get_model(wheel_config: WheelConfiguration, cache_dir: str = DEFAULT_CACHE_DIR) -> WheelModel:
+    digest = get_config_digest(wheel_config)
+    model_path = os.path.join(
+        cache_dir, f'{digest[:16]}.v{MODEL_VERSION}.model')
+    if not os.path.exists(model_path):
+        os.makedirs(cache_dir, exist_ok=True)
+        save_model(model_path, wheel_config)
+    try:
+        model = load_model(model_path)
+    except ValueError:
+        model = None
+    if model is not None and model.digest != digest:
+        model.close()
+        model = None
+    if model is None:
+        save_model(model_path, wheel_config)
+        model = load_model(model_path)
+    return model
 
 # Base class as a parent of other constraint classes
 
@@ -48,77 +327,150 @@ class Constraint(ABC):
 
     def __init__(self, position: int):
         self.position = position
+        # Positions whose assignment this constraint reads
+        self.scope: list[int] = [position]
 
     @abstractmethod
     def satisfied(self, assignment: dict[int, tuple[str, int]]):
         pass
 
+    # Returns the settings that define the constraint, used to fingerprint a puzzle for checkpoints
+    # Constraints with more settings than their position extend this
+    def get_settings(self) -> dict:
+        return {'position': self.position}
+
 # Class to check that a single wheel is in parity with its neighbors
 
 
 class NeighborConstraint(Constraint):
 
-    def __init__(self, position: int, wheel_config: WheelConfiguration):
+    # Model is optional and replaces rotating the wheels with table lookups
+    def __init__(self, position: int, wheel_config: WheelConfiguration, model: WheelModel | None = None):
         super().__init__(position)
+        # The constraint answers from the model alone, so it has to be built from this wheel set
+        if model is not None and model.digest != get_config_digest(wheel_config):
+            raise ValueError("Model was built for a different wheel set")
         self.wheel_config = wheel_config
+        self.model = model
+        # Wheels above, below, left and right, where they exist
+        self.neighbors = get_neighbors(position)
+        for neighbor in self.neighbors.values():
+            if neighbor is not None:
+                self.scope.append(neighbor)
+
+    # The wheel set is summed up by its own fingerprint, and the model is derived from it
+    def get_settings(self) -> dict:
+        return {'position': self.position, 'wheel_config': get_config_digest(self.wheel_config)}
 
     # Assignment is the current puzzle configuration
     # Wheel_config is the order of numbers on each wheel at position 0
     def satisfied(self, assignment: dict[int, tuple[str, int]]) -> bool:
-        # Identify where neighbors are
-        neighbors: dict[str, int | None] = {
-            'Up': None,
-            'Dn': None,
-            'Lt': None,
-            'Rt': None
-        }
-        # Identify location of wheel above, if it exists
-        if self.position >= 4 and self.position <= 11:
-            neighbors['Up'] = self.position - 4
-        # Identify location of wheel below, if it exists and has been assigned
-        if self.position >= 0 and self.position <= 7:
-            if self.position + 4 in assignment:
-                if assignment[self.position + 4] is not None:
-                    neighbors['Dn'] = self.position + 4
-        # Identify location of wheel to the left, if it exists
-        if self.position not in [0, 4, 8]:
-            neighbors['Lt'] = self.position - 1
-        # Identify location of wheel to the right, if it exists and has been assigned
-        if self.position not in [3, 7, 11]:
-            if self.position + 1 in assignment:
-                if assignment[self.position + 1] is not None:
-                    neighbors['Rt'] = self.position + 1
-
-        # Get orientation of the current wheel
-        current_config = get_wheel_at_position(
-            self.wheel_config, assignment[self.position][0], assignment[self.position][1])
+        # Identify which neighbors exist and have been assigned
+        neighbors: dict[str, int | None] = {}
+        for direction, neighbor in self.neighbors.items():
+            if neighbor is not None and assignment.get(neighbor) is not None:
+                neighbors[direction] = neighbor
+            else:
+                neighbors[direction] = None
+        # Nothing to check until a neighbor has been placed
+        if all(neighbor is None for neighbor in neighbors.values()):
+            return True
+
+        # Get the edge numbers of the current wheel
+        current_edges = self.get_edges(assignment[self.position])
         # Check above
         if neighbors['Up'] is not None:
-            up_config = get_wheel_at_position(
-                self.wheel_config, assignment[neighbors['Up']][0], assignment[neighbors['Up']][1])
-            if up_config[6] != current_config[0]:
+            up_edges = self.get_edges(assignment[neighbors['Up']])
+            if up_edges[2] != current_edges[0]:
                 return False
         # Check below
         if neighbors['Dn'] is not None:
-            dn_config = get_wheel_at_position(
-                self.wheel_config, assignment[neighbors['Dn']][0], assignment[neighbors['Dn']][1])
-            if dn_config[0] != current_config[6]:
+            dn_edges = self.get_edges(assignment[neighbors['Dn']])
+            if dn_edges[0] != current_edges[2]:
                 return False
         # Check left
         if neighbors['Lt'] is not None:
-            lt_config = get_wheel_at_position(
-                self.wheel_config, assignment[neighbors['Lt']][0], assignment[neighbors['Lt']][1])
-            if lt_config[3] != current_config[9]:
+            lt_edges = self.get_edges(assignment[neighbors['Lt']])
+            if lt_edges[1] != current_edges[3]:
                 return False
         # Check right
         if neighbors['Rt'] is not None:
-            rt_config = get_wheel_at_position(
-                self.wheel_config, assignment[neighbors['Rt']][0], assignment[neighbors['Rt']][1])
-            if rt_config[9] != current_config[3]:
+            rt_edges = self.get_edges(assignment[neighbors['Rt']])
+            if rt_edges[3] != current_edges[1]:
                 return False
 
         return True
 
+    # Returns the numbers at 12, 3, 6 and 9 o'clock for a placed wheel
+    def get_edges(self, placement: tuple[str, int]) -> bytes | list[int]:
+        if self.model is not None:
+            return self.model.get_edges(placement[0], placement[1])
+        rotated = get_wheel_at_position(
+            self.wheel_config, placement[0], placement[1])
+        return [rotated[slot] for slot in EDGE_SLOTS]
+
+# Global constraint that each wheel id is used at most once
+# Wheel ids are mapped to bits, so a set of wheels is stored as a single int
+
+
+class AllDifferentConstraint:
+
+    def __init__(self, wheel_choices: WheelChoices):
+        self.wheel_bits: dict[str, int] = {}
+        for idx, wheel_id in enumerate(wheel_choices):
+            self.wheel_bits[wheel_id] = 1 << idx
+
+    # Converts a list of wheel ids into a bitmask
+    def mask(self, wheel_ids: list[str]) -> int:
+        result = 0
+        for wheel_id in wheel_ids:
+            result |= self.wheel_bits[wheel_id]
+        return result
+
+    # Finds a distinct wheel for every candidate mask (Hall's condition)
+    # Returns the matching as wheel bit -> index into candidate_masks, or None if it cannot be done
+    def matching(self, candidate_masks: list[int]) -> dict[int, int] | None:
+        matched: dict[int, int] = {}
+        for idx in range(len(candidate_masks)):
+            if not self._augment(idx, candidate_masks, matched, [0]):
+                return None
+        return matched
+
+    # Looks for an augmenting path starting at candidate_masks[idx] (Kuhn's algorithm)
+    # Visited holds the mask of wheels already tried during this search
+    def _augment(self, idx: int, candidate_masks: list[int], matched: dict[int, int], visited: list[int]) -> bool:
+        options = candidate_masks[idx]
+        while options:
+            bit = options & -options
+            options ^= bit
+            if visited[0] & bit:
+                continue
+            visited[0] |= bit
+            if bit not in matched or self._augment(matched[bit], candidate_masks, matched, visited):
+                matched[bit] = idx
+                return True
+        return False
+
+    # Returns the wheels of this_mask that still leave a distinct wheel for every other position
+    # Any wheel that would break Hall's condition for the other positions is pruned
+    def viable_wheels(self, this_mask: int, other_masks: list[int]) -> int:
+        matched = self.matching(other_masks)
+        if matched is None:
+            return 0
+        # Wheels the other positions do not need are always viable
+        matched_bits = 0
+        for bit in matched:
+            matched_bits |= bit
+        viable = this_mask & ~matched_bits
+        # Wheels the other positions are using need a matching without them
+        options = this_mask & matched_bits
+        while options:
+            bit = options & -options
+            options ^= bit
+            if self.matching([m & ~bit for m in other_masks]) is not None:
+                viable |= bit
+        return viable
+
 
 class CSP:
 
@@ -127,13 +479,50 @@ class CSP:
         self.positions = positions
         self.domains = domains
         self.constraints: dict[int, list[Constraint]] = {}
+        # Maps each position to the other positions its constraints read
+        self.neighbors: dict[int, list[int]] = {}
 
         for position in self.positions:
             self.constraints[position] = []
+            self.neighbors[position] = []
             if position not in self.domains:
                 raise LookupError(
                     "Every position should have a domain assigned to it")
 
+        # Each wheel may only be used once across all positions
+        wheel_choices: WheelChoices = []
+        for position in self.positions:
+            for wheel_id in self.domains[position][0]:
+                if wheel_id not in wheel_choices:
+                    wheel_choices.append(wheel_id)
+        self.all_different = AllDifferentConstraint(wheel_choices)
+        self.compatible_cache: dict[tuple, int] = {}
+        self.ordering = 'first'
+        self.value_ordering = 'ascending'
+        self.seed: int | None = None
+        self.restarts = 'none'
+        self.restart_base = 100
+        self.restart_factor = 1.5
+        # Random generator for tie-breaking, only set when a seed is given
+        self.random: random.Random | None = None
+        # Failures (dead ends) seen in the current run and the limit before a restart
+        self.failures = 0
+        self.failure_limit: int | None = None
+        # Counts how many times each configuration has won a portfolio race
+        self.portfolio_wins: dict[str, int] = {}
+        # State of an exhaustive search, see search_all
+        self.solutions: list[dict[int, tuple[str, int]]] = []
+        self.resume_path: list[tuple[int, tuple[str, int]]] = []
+        self.checkpoint_path: str | None = None
+        self.checkpoint_interval = 60.0
+        self.last_checkpoint = 0.0
+        self.digest = ''
+        self.initial_assignment: dict[int, tuple[str, int]] = {}
+        self.domain_masks: dict[int, int] = {}
+        for position in self.positions:
+            self.domain_masks[position] = self.all_different.mask(
+                self.domains[position][0])
+
     # Adds constraints to each position
     def add_constraint(self, constraint: Constraint):
 
@@ -141,6 +530,20 @@ class CSP:
             raise LookupError("Position in constraint not in CSP")
         else:
             self.constraints[constraint.position].append(constraint)
+            self.compatible_cache.clear()
+            for position in constraint.scope:
+                if position != constraint.position and position not in self.neighbors[constraint.position]:
+                    self.neighbors[constraint.position].append(position)
+
+    # Sets how the search picks positions and wheels
+    def configure(self, configuration: SearchConfiguration) -> None:
+        check_configuration(configuration)
+        self.ordering = configuration.get('ordering', 'first')
+        self.value_ordering = configuration.get('value_ordering', 'ascending')
+        self.seed = configuration.get('seed')
+        self.restarts = configuration.get('restarts', 'none')
+        self.restart_base = configuration.get('restart_base', 100)
+        self.restart_factor = configuration.get('restart_factor', 1.5)
 
     # Checks if all position constraints have been satisfied
     def consistent(self, position: int, assignment: dict[int, tuple[str, int]]) -> bool:
@@ -149,36 +552,305 @@ class CSP:
                 return False
         return True
 
-    # Recursive method responsible for solving the puzzle
+    # Returns the mask of wheels that fit at least one orientation next to the placed neighbors
+    # Results only depend on the neighbors, so they are cached for reuse across the search
+    def compatible_wheels(self, position: int, assignment: dict[int, tuple[str, int]]) -> int:
+        key = (position, tuple(assignment.get(n) for n in self.neighbors[position]))
+        if key in self.compatible_cache:
+            return self.compatible_cache[key]
+
+        compatible = 0
+        local_assignment = {n: assignment[n]
+                            for n in self.neighbors[position] if n in assignment}
+        for wheel_choice in self.domains[position][0]:
+            for wheel_config in self.domains[position][1]:
+                local_assignment[position] = (wheel_choice, wheel_config)
+                if self.consistent(position, local_assignment):
+                    compatible |= self.all_different.wheel_bits[wheel_choice]
+                    break
+        self.compatible_cache[key] = compatible
+        return compatible
+
+    # Returns the wheels each unassigned position could still take
+    # Only positions next to a placed wheel need their orientations checked
+    def candidate_masks(self, assignment: dict[int, tuple[str, int]], used_wheels: int) -> dict[int, int]:
+        masks: dict[int, int] = {}
+        for position in self.positions:
+            if position in assignment:
+                continue
+            available = self.domain_masks[position] & ~used_wheels
+            if any(n in assignment for n in self.neighbors[position]):
+                available &= self.compatible_wheels(position, assignment)
+            masks[position] = available
+        return masks
+
+    # Chooses the next position to fill in
+    def select_position(self, masks: dict[int, int]) -> int:
+        unassigned = list(masks.keys())
+        if self.ordering == 'first':
+            return unassigned[0]
+        if self.ordering == 'last':
+            return unassigned[-1]
+        # Pick the position with the fewest wheels left
+        fewest = min(masks[position].bit_count() for position in unassigned)
+        best_positions = [
+            position for position in unassigned if masks[position].bit_count() == fewest]
+        # Ties go to the first position unless the search is randomized
+        if self.random is not None:
+            return self.random.choice(best_positions)
+        return best_positions[0]
+
+    # Puts the wheel choices and orientations of a position in the order they should be tried
+    def order_values(self, position: int) -> tuple[list[str], list[int]]:
+        wheel_choices = list(self.domains[position][0])
+        wheel_orientations = list(self.domains[position][1])
+        if self.value_ordering == 'descending':
+            wheel_choices.reverse()
+        if self.random is not None:
+            self.random.shuffle(wheel_choices)
+            self.random.shuffle(wheel_orientations)
+        return wheel_choices, wheel_orientations
+
+    # Solves the puzzle starting from the given assignment
+    # With a restart policy, each run is cut off after a number of failures and the search starts over
     def backtracking_search(self, assignment: dict[int, tuple[str, int]]) -> dict[int, tuple[str, int]] | None:
+        self.random = None if self.seed is None else random.Random(self.seed)
+        used_wheels = self.all_different.mask(
+            [item[0] for item in assignment.values()])
+        run = 1
+        while True:
+            self.failures = 0
+            if self.restarts == 'luby':
+                self.failure_limit = self.restart_base * luby(run)
+            elif self.restarts == 'geometric':
+                self.failure_limit = int(
+                    self.restart_base * self.restart_factor ** (run - 1))
+            else:
+                self.failure_limit = None
+            try:
+                return self.recursive_search(assignment, used_wheels)
+            except RestartSearch:
+                run += 1
+
+    # Recursive method responsible for solving the puzzle
+    # Used_wheels is a bitmask of the wheels already placed, kept up to date as the search recurses
+    def recursive_search(self, assignment: dict[int, tuple[str, int]], used_wheels: int) -> dict[int, tuple[str, int]] | None:
         # Check if each position has an assignment. If so, stop
         if len(assignment) == len(self.positions):
             return assignment
 
-        # Get all positions that have not been assigned
-        unassigned = [v for v in self.positions if v not in assignment]
-
-        # Choose the first unassigned position
-        this_position = unassigned[0]
+        # Get the wheels every open position could still take and choose a position
+        masks = self.candidate_masks(assignment, used_wheels)
+        this_position = self.select_position(masks)
 
         # Get wheel id's that are still available for that position
-        used_wheels: list[str] = []
-        for item in list(assignment.values()):
-            used_wheels.append(item[0])
-        available_wheels = [
-            w for w in self.domains[this_position][0] if w not in used_wheels]
-        for wheel_choice in available_wheels:
-            for wheel_config in self.domains[this_position][1]:
+        # If the other positions cannot all be given distinct wheels, this branch is dead
+        other_masks = [mask for position,
+                       mask in masks.items() if position != this_position]
+        viable = self.all_different.viable_wheels(
+            masks[this_position], other_masks)
+        wheel_choices, wheel_orientations = self.order_values(this_position)
+        for wheel_choice in wheel_choices:
+            bit = self.all_different.wheel_bits[wheel_choice]
+            if not viable & bit:
+                continue
+            for wheel_config in wheel_orientations:
                 local_assignment = assignment.copy()
                 local_assignment[this_position] = (wheel_choice, wheel_config)
                 # Check if constraints are satisfied.
                 # If so, continue to recurse
                 if self.consistent(this_position, local_assignment):
-                    result = self.backtracking_search(local_assignment)
+                    result = self.recursive_search(
+                        local_assignment, used_wheels | bit)
                     if result is not None:
                         return result
+
+        # Dead end, so count a failure and restart once the limit is reached
+        self.failures += 1
+        if self.failure_limit is not None and self.failures >= self.failure_limit:
+            raise RestartSearch()
         return None
 
+    # Returns a fingerprint of the puzzle: its domains and the type and settings of every constraint
+    # Used to make sure a checkpoint is only resumed on the puzzle it was made for
+    def get_digest(self) -> str:
+        constraints = []
+        for position in self.positions:
+            for constraint in self.constraints[position]:
+                constraints.append(
+                    [type(constraint).__name__, constraint.get_settings()])
+        contents = json.dumps({
+            'positions': self.positions,
+            'domains': [self.domains[position] for position in self.positions],
+            'constraints': constraints
+        }, sort_keys=True)
+        return hashlib.sha256(contents.encode()).hexdigest()
+
+    # Finds every solution starting from the given assignment
+    # With a checkpoint path, progress is written to that file every checkpoint_interval seconds
+    # Calling again with the same file picks the search up where the last run stopped
+    def search_all(self, assignment: dict[int, tuple[str, int]], checkpoint_path: str | None = None, checkpoint_interval: float = 60.0) -> list[dict[int, tuple[str, int]]]:
+        if self.seed is not None:
+            raise ValueError(
+                "A resumable search needs a fixed ordering, so it cannot use a seed")
+        self.random = None
+        self.failure_limit = None
+        self.solutions = []
+        self.resume_path = []
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self.last_checkpoint = time.monotonic()
+        self.initial_assignment = assignment
+        # The fingerprint is only needed to match the search to a checkpoint file
+        self.digest = '' if checkpoint_path is None else self.get_digest()
+
+        if checkpoint_path is not None and os.path.exists(checkpoint_path):
+            checkpoint = load_checkpoint(checkpoint_path)
+            if checkpoint['digest'] != self.digest:
+                raise ValueError(
+                    "Checkpoint was made for a different set of domains or constraints")
+            if checkpoint['assignment'] != assignment:
+                raise ValueError("Checkpoint was made for a different puzzle")
+            if checkpoint['ordering'] != self.ordering or checkpoint['value_ordering'] != self.value_ordering:
+                raise ValueError(
+                    "Checkpoint was made with a different search ordering")
+            self.solutions = checkpoint['solutions']
+            if checkpoint['done']:
+                return self.solutions
+            self.resume_path = checkpoint['path']
+
+        used_wheels = self.all_different.mask(
+            [item[0] for item in assignment.values()])
+        self.exhaustive_search(assignment, used_wheels, [])
+        if checkpoint_path is not None:
+            self.save_progress([], True)
+        return self.solutions
+
+    # Writes the current progress of search_all to its checkpoint file
+    def save_progress(self, path: list[tuple[int, tuple[str, int]]], done: bool) -> None:
+        if self.checkpoint_path is None:
+            return
+        save_checkpoint(self.checkpoint_path, {
+            'version': CHECKPOINT_VERSION,
+            'digest': self.digest,
+            'ordering': self.ordering,
+            'value_ordering': self.value_ordering,
+            'assignment': self.initial_assignment,
+            'path': path,
+            'solutions': self.solutions,
+            'done': done
+        })
+        self.last_checkpoint = time.monotonic()
+
+    # Recursive method that visits every solution
+    # Path holds the (position, (wheel id, orientation)) choices that led to this assignment
+    def exhaustive_search(self, assignment: dict[int, tuple[str, int]], used_wheels: int, path: list[tuple[int, tuple[str, int]]]) -> None:
+        # Once the checkpointed node is reached again, the search carries on as normal
+        if len(path) == len(self.resume_path):
+            self.resume_path = []
+        # Save progress before exploring this node, so a resumed run explores it again in full
+        if self.checkpoint_path is not None and not self.resume_path:
+            if time.monotonic() - self.last_checkpoint >= self.checkpoint_interval:
+                self.save_progress(path, False)
+
+        # Check if each position has an assignment. If so, record it
+        if len(assignment) == len(self.positions):
+            self.solutions.append(assignment)
+            return
+
+        masks = self.candidate_masks(assignment, used_wheels)
+        this_position = self.select_position(masks)
+        # When resuming, skip the values explored before the checkpoint
+        resume_choice = None
+        if self.resume_path:
+            resume_choice = self.resume_path[len(path)]
+            if resume_choice[0] != this_position:
+                raise ValueError("Checkpoint does not match this search")
+
+        other_masks = [mask for position,
+                       mask in masks.items() if position != this_position]
+        viable = self.all_different.viable_wheels(
+            masks[this_position], other_masks)
+        wheel_choices, wheel_orientations = self.order_values(this_position)
+        for wheel_choice in wheel_choices:
+            bit = self.all_different.wheel_bits[wheel_choice]
+            if not viable & bit:
+                continue
+            for wheel_config in wheel_orientations:
+                if resume_choice is not None:
+                    if (wheel_choice, wheel_config) != resume_choice[1]:
+                        continue
+                    resume_choice = None
+                local_assignment = assignment.copy()
+                local_assignment[this_position] = (wheel_choice, wheel_config)
+                # Check if constraints are satisfied.
+                # If so, continue to recurse
+                if self.consistent(this_position, local_assignment):
+                    self.exhaustive_search(
+                        local_assignment, used_wheels | bit, path + [(this_position, (wheel_choice, wheel_config))])
+
+    # Races several differently configured searches in separate processes
+    # Returns the name of the first configuration to finish along with its result
+    # The other searches are stopped once an answer is in
+    def portfolio_search(self, assignment: dict[int, tuple[str, int]], configurations: list[SearchConfiguration] | None = None, timeout: float | None = None) -> tuple[str, dict[int, tuple[str, int]] | None]:
+        if configurations is None:
+            configurations = DEFAULT_PORTFOLIO
+        # Check every configuration up front, so a bad one cannot quietly drop out of the race
+        names: set[str] = set()
+        for configuration in configurations:
+            if 'name' not in configuration:
+                raise ValueError("Every portfolio configuration needs a name")
+            if configuration['name'] in names:
+                raise ValueError(
+                    f"Portfolio configuration name '{configuration['name']}' is used more than once")
+            names.add(configuration['name'])
+            check_configuration(configuration)
+        results: multiprocessing.Queue = multiprocessing.Queue()
+        processes: list[multiprocessing.Process] = []
+        for configuration in configurations:
+            process = multiprocessing.Process(
+                target=_portfolio_worker, args=(self, configuration, assignment, results), daemon=True)
+            process.start()
+            processes.append(process)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            while True:
+                try:
+                    name, solution, error = results.get(timeout=0.1)
+                    break
+                except queue.Empty:
+                    if not any(process.is_alive() for process in processes) and results.empty():
+                        raise RuntimeError(
+                            "Every search in the portfolio stopped without an answer")
+                    if deadline is not None and time.monotonic() > deadline:
+                        raise TimeoutError(
+                            "No search in the portfolio finished in time")
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+            for process in processes:
+                process.join()
+            results.close()
+
+        if error is not None:
+            raise RuntimeError(
+                f"Search '{name}' in the portfolio failed") from error
+        self.portfolio_wins[name] = self.portfolio_wins.get(name, 0) + 1
+        return name, solution
+
+# Runs one portfolio search and reports its result, or the error that stopped it, back to the parent process
+
+
+def _portfolio_worker(csp: CSP, configuration: SearchConfiguration, assignment: dict[int, tuple[str, int]], results: multiprocessing.Queue) -> None:
+    try:
+        csp.configure(configuration)
+        solution = csp.backtracking_search(assignment)
+    except Exception as error:
+        results.put((configuration['name'], None, error))
+        return
+    results.put((configuration['name'], solution, None))
+
 # Solution is the same structure as assignment
 
 
@@ -295,13 +967,18 @@ if __name__ == "__main__":
     # Instantiate CSP class
     csp = CSP(wheel_locations, domains)
 
+    # Load the compiled wheel model, building it on the first run
+    model = get_model(wheel_config)
+
     # Add constraints
     for location in wheel_locations:
-        csp.add_constraint(NeighborConstraint(location, wheel_config))
+        csp.add_constraint(NeighborConstraint(location, wheel_config, model))
 
     # Get solution
-    solution = csp.backtracking_search(assignment)
+    # The portfolio races several search configurations and keeps the first answer
+    winner, solution = csp.portfolio_search(assignment)
     if solution is None:
         print('No solution found')
     else:
         print_solution(wheel_config, solution)
+        print(f'Solved by {winner}')
@@ -0,0 +1,124 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+from dodecagon_solver import designer
+from dodecagon_solver import dodecagon_solver as doso
+
+
+class TestDesigner(unittest.TestCase):
+
+    def setUp(self):
+        self.wheel_config = {
+            'A': [1, 5, 4, 12, 7, 2, 9, 8, 3, 11, 6, 10],
+            'B': [1, 12, 9, 10, 8, 4, 2, 11, 7, 3, 5, 6],
+            'C': [1, 6, 7, 10, 4, 2, 11, 3, 12, 9, 8, 3],
+            'D': [1, 8, 9, 10, 11, 12, 7, 2, 3, 4, 5, 6],
+            'E': [1, 5, 11, 2, 4, 3, 10, 7, 8, 6, 12, 9],
+            'F': [1, 10, 11, 3, 4, 8, 9, 2, 6, 5, 7, 12],
+            'G': [1, 7, 2, 5, 10, 12, 11, 9, 5, 6, 4, 8],
+            'H': [1, 10, 12, 6, 7, 5, 3, 2, 9, 8, 11, 4],
+            'I': [1, 7, 5, 3, 12, 10, 11, 9, 2, 6, 4, 8],
+            'J': [1, 7, 11, 2, 4, 3, 12, 5, 8, 6, 10, 9],
+            'K': [1, 3, 10, 12, 6, 4, 2, 7, 9, 5, 8, 11],
+            'L': [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12],
+        }
+
+    def test_count_solutions_stops_at_limit(self):
+        self.assertEqual(designer.count_solutions(self.wheel_config, 1), 1)
+        self.assertEqual(designer.count_solutions(self.wheel_config, 2), 2)
+
+    def test_count_solutions_with_no_solution(self):
+        # No two wheels share a number, so no wheels can touch
+        wheel_config = {}
+        for idx, wheel_id in enumerate(designer.WHEEL_IDS):
+            wheel_config[wheel_id] = [idx * 12 + number for number in range(1, 13)]
+        self.assertEqual(designer.count_solutions(wheel_config, 2), 0)
+
+    # The solver also lists each solution turned 180 degrees, so it finds twice as many
+    def test_count_solutions_matches_solver(self):
+        # Few numbers are shared between wheels, so the solver can search every board quickly
+        wheel_config = {
+            'A': [1, 7, 8, 6, 9, 10, 6, 11, 12, 13, 14, 15],
+            'B': [16, 17, 18, 5, 1, 19, 4, 20, 21, 6, 22, 23],
+            'C': [24, 25, 26, 2, 27, 28, 5, 29, 30, 5, 6, 31],
+            'D': [32, 3, 33, 34, 35, 36, 6, 37, 3, 2, 38, 39],
+            'E': [6, 40, 2, 1, 41, 42, 4, 43, 44, 45, 6, 46],
+            'F': [4, 47, 48, 6, 1, 49, 5, 50, 51, 1, 2, 52],
+            'G': [5, 53, 54, 3, 55, 56, 6, 57, 58, 6, 59, 60],
+            'H': [6, 61, 62, 63, 5, 1, 6, 64, 65, 3, 66, 67],
+            'I': [4, 5, 68, 4, 69, 2, 70, 71, 1, 72, 73, 74],
+            'J': [5, 75, 76, 1, 77, 78, 79, 80, 81, 4, 2, 82],
+            'K': [6, 83, 84, 6, 85, 86, 3, 87, 88, 1, 89, 90],
+            'L': [6, 91, 92, 93, 4, 6, 94, 95, 96, 6, 97, 98],
+        }
+        domains = {}
+        for location in range(0, 12):
+            domains[location] = (designer.WHEEL_IDS, list(range(0, 12)))
+        csp = doso.CSP(list(range(0, 12)), domains)
+        for location in range(0, 12):
+            csp.add_constraint(doso.NeighborConstraint(location, wheel_config))
+        count = designer.count_solutions(wheel_config, None)
+        self.assertGreater(count, 1)
+        self.assertEqual(2 * count, len(csp.search_all({})))
+
+    def test_canonical_key_ignores_labels_rotations_and_mirroring(self):
+        relabelled = {
+            'A': self.wheel_config['B'],
+            'B': self.wheel_config['A'],
+        }
+        for wheel_id in designer.WHEEL_IDS[2:]:
+            # Turn each wheel round
+            wheel = doso.get_wheel_at_position(self.wheel_config, wheel_id, 5)
+            relabelled[wheel_id] = wheel
+        # Read every wheel the other way round, as on a mirrored board
+        mirrored = {wheel_id: [wheel[0]] + list(reversed(wheel[1:]))
+                    for wheel_id, wheel in relabelled.items()}
+        key = designer.canonical_key(self.wheel_config)
+        self.assertEqual(designer.canonical_key(relabelled), key)
+        self.assertEqual(designer.canonical_key(mirrored), key)
+
+    def test_generate_candidates_are_distinct(self):
+        candidates = designer.generate_candidates(3, max_number=12)
+        keys = set(designer.canonical_key(next(candidates))
+                   for _ in range(0, 20))
+        self.assertEqual(len(keys), 20)
+
+    def test_design_writes_accepted_designs(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output_path = os.path.join(directory, 'designs.jsonl')
+            accepted = designer.design(
+                output_path, 4, target=1, seed=1, max_number=20, processes=2)
+            with open(output_path) as output_file:
+                lines = [json.loads(line) for line in output_file]
+        self.assertGreater(len(accepted), 0)
+        self.assertEqual(len(lines), len(accepted))
+        for line in lines:
+            self.assertEqual(line['solutions_up_to_rotation'], 1)
+            self.assertEqual(designer.count_solutions(
+                line['wheel_config'], 2), 1)
+
+    # With only a few candidates in flight at a time, each must still be checked exactly once
+    def test_design_checks_every_candidate_with_small_window(self):
+        checked = []
+        generate_candidates = designer.generate_candidates
+
+        def recording_candidates(seed, max_number):
+            for wheel_config in generate_candidates(seed, max_number):
+                checked.append(wheel_config)
+                yield wheel_config
+
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(designer, 'DESIGN_TASKS_PER_PROCESS', 1), \
+                mock.patch.object(designer, 'generate_candidates', recording_candidates):
+            output_path = os.path.join(directory, 'designs.jsonl')
+            accepted = designer.design(
+                output_path, 5, target=1, seed=1, max_number=20, processes=2)
+        self.assertEqual(len(checked), 5)
+        for wheel_config in accepted:
+            self.assertIn(wheel_config, checked)
+
+
+if __name__ == '__main__':
+    unittest.main()
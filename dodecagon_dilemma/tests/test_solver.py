@@ -1,3 +1,5 @@
+import os
+import tempfile
 import unittest
 from dodecagon_solver import dodecagon_solver as doso
 
@@ -132,6 +134,274 @@ class TestSolver(unittest.TestCase):
         constraint = doso.NeighborConstraint(5, self.wheel_config)
         self.assertTrue(constraint.satisfied(puzzle_state))
 
+    def test_neighbor_constraint_when_satisfied_and_behind_wheels_missing(self):
+        puzzle_state = {
+            5: ('A', 0),
+            6: ('D', 4),
+            9: ('E', 1)
+        }
+        constraint = doso.NeighborConstraint(5, self.wheel_config)
+        self.assertTrue(constraint.satisfied(puzzle_state))
+
+    def test_all_different_mask(self):
+        all_different = doso.AllDifferentConstraint(['A', 'B', 'C'])
+        self.assertEqual(all_different.mask(['A', 'C']), 0b101)
+
+    def test_all_different_matching_when_hall_condition_broken(self):
+        all_different = doso.AllDifferentConstraint(['A', 'B', 'C'])
+        # Three positions share only two wheels
+        self.assertIsNone(all_different.matching([0b001, 0b011, 0b011]))
+
+    def test_all_different_matching_when_hall_condition_holds(self):
+        all_different = doso.AllDifferentConstraint(['A', 'B', 'C'])
+        self.assertIsNotNone(all_different.matching([0b001, 0b011, 0b111]))
+
+    # Wheels A and B are needed by the other two positions, so only C is left
+    def test_all_different_viable_wheels_prunes_hall_set(self):
+        all_different = doso.AllDifferentConstraint(['A', 'B', 'C'])
+        self.assertEqual(all_different.viable_wheels(
+            0b111, [0b011, 0b011]), 0b100)
+
+    def make_csp(self) -> doso.CSP:
+        wheel_choices = list(self.wheel_config.keys())
+        domains = {}
+        for location in range(0, 12):
+            domains[location] = (wheel_choices, list(range(0, 12)))
+        csp = doso.CSP(list(range(0, 12)), domains)
+        for location in range(0, 12):
+            csp.add_constraint(doso.NeighborConstraint(
+                location, self.wheel_config))
+        return csp
+
+    def assert_valid_solution(self, csp: doso.CSP, solution):
+        self.assertIsNotNone(solution)
+        self.assertEqual(len(set(item[0] for item in solution.values())), 12)
+        for location in range(0, 12):
+            self.assertTrue(csp.consistent(location, solution))
+
+    def test_backtracking_search_finds_solution(self):
+        csp = self.make_csp()
+        self.assert_valid_solution(csp, csp.backtracking_search({}))
+
+    def test_backtracking_search_finds_solution_with_mrv_ordering(self):
+        csp = self.make_csp()
+        csp.configure({'ordering': 'mrv', 'value_ordering': 'descending'})
+        self.assert_valid_solution(csp, csp.backtracking_search({}))
+
+    def test_configure_rejects_unknown_ordering(self):
+        csp = self.make_csp()
+        with self.assertRaises(ValueError):
+            csp.configure({'ordering': 'random'})
+
+    def test_portfolio_search_records_winner(self):
+        csp = self.make_csp()
+        winner, solution = csp.portfolio_search({}, [
+            {'name': 'first-descending', 'ordering': 'first',
+                'value_ordering': 'descending'},
+            {'name': 'mrv', 'ordering': 'mrv'},
+        ])
+        self.assertIn(winner, ['first-descending', 'mrv'])
+        self.assertEqual(csp.portfolio_wins, {winner: 1})
+        self.assert_valid_solution(csp, solution)
+
+    def test_portfolio_search_checks_configurations_first(self):
+        csp = self.make_csp()
+        for configurations in [
+                [{'name': 'mrv', 'ordering': 'mvr'}],
+                [{'ordering': 'mrv'}],
+                [{'name': 'mrv', 'ordering': 'mrv'}, {'name': 'mrv', 'ordering': 'first'}]]:
+            with self.assertRaises(ValueError):
+                csp.portfolio_search({}, configurations)
+        self.assertEqual(csp.portfolio_wins, {})
+
+    # An error inside a search is sent back to the parent instead of being lost with the process
+    def test_portfolio_search_reports_worker_error(self):
+        csp = self.make_csp()
+        with self.assertRaises(RuntimeError) as context:
+            csp.portfolio_search({0: ('Z', 0)}, [{'name': 'first'}])
+        self.assertIsInstance(context.exception.__cause__, KeyError)
+
+    def test_luby_sequence(self):
+        self.assertEqual([doso.luby(i) for i in range(1, 16)], [
+                         1, 1, 2, 1, 1, 2, 4, 1, 1, 2, 1, 1, 2, 4, 8])
+
+    def test_configure_rejects_restarts_without_seed(self):
+        csp = self.make_csp()
+        with self.assertRaises(ValueError):
+            csp.configure({'restarts': 'luby'})
+
+    # A limit that shrinks or stays the same would restart forever on a hard puzzle
+    def test_configure_rejects_restart_factor_not_above_one(self):
+        csp = self.make_csp()
+        for restart_factor in [0.5, 1.0]:
+            with self.assertRaises(ValueError):
+                csp.configure({'seed': 1, 'restarts': 'geometric',
+                               'restart_factor': restart_factor})
+
+    def test_configure_rejects_restart_base_below_one(self):
+        csp = self.make_csp()
+        with self.assertRaises(ValueError):
+            csp.configure({'seed': 1, 'restarts': 'luby', 'restart_base': 0})
+
+    # The same seed must give the same search, restarts included
+    def test_randomized_search_is_reproducible(self):
+        configuration = {'ordering': 'mrv', 'seed': 7,
+                         'restarts': 'geometric', 'restart_base': 10,
+                         'restart_factor': 2.0}
+        first_csp = self.make_csp()
+        first_csp.configure(configuration)
+        first_solution = first_csp.backtracking_search({})
+        second_csp = self.make_csp()
+        second_csp.configure(configuration)
+        second_solution = second_csp.backtracking_search({})
+        self.assert_valid_solution(first_csp, first_solution)
+        self.assertEqual(first_solution, second_solution)
+        self.assertEqual(first_csp.failures, second_csp.failures)
+
+    def test_restart_limit_follows_luby_sequence(self):
+        csp = self.make_csp()
+        csp.configure({'ordering': 'mrv', 'seed': 3,
+                      'restarts': 'luby', 'restart_base': 1})
+        self.assert_valid_solution(csp, csp.backtracking_search({}))
+        self.assertLess(csp.failures, csp.failure_limit)
+        self.assertIn(csp.failure_limit, [1, 2, 4, 8, 16, 32, 64, 128, 256])
+
+    # Partial board with exactly two ways to finish it
+    def make_two_solution_assignment(self):
+        return {0: ('A', 0), 1: ('L', 10), 2: ('E', 0), 4: ('K', 4)}
+
+    def test_search_all_finds_every_solution(self):
+        csp = self.make_csp()
+        solutions = csp.search_all(self.make_two_solution_assignment())
+        self.assertEqual(len(solutions), 2)
+        for solution in solutions:
+            self.assert_valid_solution(csp, solution)
+
+    def test_search_all_resumes_from_checkpoint(self):
+        assignment = self.make_two_solution_assignment()
+        expected = self.make_csp().search_all(assignment)
+
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint_path = os.path.join(directory, 'search.json')
+            # Stop the first run after it has found one solution, as if the process had been killed
+            interrupted_csp = self.make_csp()
+            save_progress = interrupted_csp.save_progress
+            saves = []
+
+            def interrupt(path, done):
+                save_progress(path, done)
+                saves.append(path)
+                if len(saves) == 40:
+                    raise KeyboardInterrupt()
+            interrupted_csp.save_progress = interrupt
+            with self.assertRaises(KeyboardInterrupt):
+                interrupted_csp.search_all(
+                    assignment, checkpoint_path, checkpoint_interval=0)
+            checkpoint = doso.load_checkpoint(checkpoint_path)
+            self.assertFalse(checkpoint['done'])
+            self.assertEqual(len(checkpoint['solutions']), 1)
+
+            resumed = self.make_csp().search_all(
+                assignment, checkpoint_path, checkpoint_interval=0)
+            self.assertEqual(resumed, expected)
+            self.assertTrue(doso.load_checkpoint(checkpoint_path)['done'])
+
+            # A finished checkpoint just returns its solutions
+            self.assertEqual(self.make_csp().search_all(
+                assignment, checkpoint_path), expected)
+
+    def test_search_all_rejects_checkpoint_for_other_wheel_set(self):
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint_path = os.path.join(directory, 'search.json')
+            self.make_csp().search_all(
+                self.make_two_solution_assignment(), checkpoint_path)
+            # Same starting assignment, but every wheel read the other way round
+            self.wheel_config = {wheel_id: list(reversed(wheel))
+                                 for wheel_id, wheel in self.wheel_config.items()}
+            with self.assertRaises(ValueError):
+                self.make_csp().search_all(
+                    self.make_two_solution_assignment(), checkpoint_path)
+
+    def test_search_all_rejects_checkpoint_for_other_ordering(self):
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint_path = os.path.join(directory, 'search.json')
+            self.make_csp().search_all(
+                self.make_two_solution_assignment(), checkpoint_path)
+            csp = self.make_csp()
+            csp.configure({'ordering': 'last'})
+            with self.assertRaises(ValueError):
+                csp.search_all(
+                    self.make_two_solution_assignment(), checkpoint_path)
+
+    def test_model_edges_match_wheel_rotation(self):
+        model = doso.parse_model(doso.build_model(self.wheel_config))
+        rotated = doso.get_wheel_at_position(self.wheel_config, 'F', 4)
+        self.assertEqual(list(model.get_edges('F', 4)), [
+                         rotated[0], rotated[3], rotated[6], rotated[9]])
+
+    def test_model_rejects_other_version(self):
+        data = bytearray(doso.build_model(self.wheel_config))
+        data[4] += 1
+        with self.assertRaises(ValueError):
+            doso.parse_model(bytes(data))
+
+    def test_get_model_builds_then_loads_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            model = doso.get_model(self.wheel_config, directory)
+            self.assertEqual(len(os.listdir(directory)), 1)
+            cached_model = doso.get_model(self.wheel_config, directory)
+            self.assertIsNotNone(cached_model.mapping)
+            self.assertEqual(bytes(cached_model.edges), bytes(model.edges))
+            model.close()
+            cached_model.close()
+
+    # An interrupted write can leave an empty or damaged file, which must be rebuilt rather than break every run
+    def test_get_model_rebuilds_bad_cache_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            model = doso.get_model(self.wheel_config, directory)
+            edges = bytes(model.edges)
+            model.close()
+            model_path = os.path.join(directory, os.listdir(directory)[0])
+            for contents in [b'', b'not a model file']:
+                with open(model_path, 'wb') as model_file:
+                    model_file.write(contents)
+                model = doso.get_model(self.wheel_config, directory)
+                self.assertEqual(bytes(model.edges), edges)
+                model.close()
+
+    def test_model_closes_while_edges_are_in_use(self):
+        with tempfile.TemporaryDirectory() as directory:
+            model = doso.get_model(self.wheel_config, directory)
+            edges = model.get_edges('F', 4)
+            model.close()
+            self.assertIsNone(model.mapping)
+            self.assertEqual(len(edges), 4)
+
+    def test_neighbor_constraint_rejects_model_of_other_wheel_set(self):
+        reversed_config = {wheel_id: list(reversed(wheel))
+                           for wheel_id, wheel in self.wheel_config.items()}
+        model = doso.parse_model(doso.build_model(reversed_config))
+        with self.assertRaises(ValueError):
+            doso.NeighborConstraint(5, self.wheel_config, model)
+
+    def test_neighbor_constraint_with_model(self):
+        model = doso.parse_model(doso.build_model(self.wheel_config))
+        constraint = doso.NeighborConstraint(5, self.wheel_config, model)
+        self.assertTrue(constraint.satisfied({
+            1: ('C', 6),
+            4: ('B', 8),
+            5: ('A', 0),
+            6: ('D', 4),
+            9: ('E', 1)
+        }))
+        self.assertFalse(constraint.satisfied({
+            1: ('C', 7),
+            4: ('B', 9),
+            5: ('A', 0),
+            6: ('D', 5),
+            9: ('E', 2)
+        }))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,11 +1,131 @@
 from abc import ABC, abstractmethod
+import hashlib
+import itertools
+import json
 import math
-from typing import TypeAlias
+import multiprocessing
+import os
+import queue
+import random
+import time
+from typing import TypeAlias, TypedDict
 
 # Create types for inputs
 PuzzleDesign: TypeAlias = list[list[int]]
 NumberLocations: TypeAlias = list[int]
 NumberChoices: TypeAlias = list[int]
+# Describes how a search should be run
+# Ordering picks the next position: 'first' unassigned or 'mrv' (fewest remaining values)
+# Value_ordering is 'ascending' or 'descending'
+# Seed turns on random tie-breaking, so the same seed always gives the same search
+# Restarts is 'none', 'luby' or 'geometric' and needs a seed
+# Restart_base is the number of failures allowed before the first restart
+# Restart_factor is how much the failure limit grows per restart under 'geometric'
+SearchConfiguration = TypedDict('SearchConfiguration', {
+    'name': str,
+    'ordering': str,
+    'value_ordering': str,
+    'seed': int,
+    'restarts': str,
+    'restart_base': int,
+    'restart_factor': float
+}, total=False)
+
+# Configurations raced by CSP.portfolio_search when none are given
+DEFAULT_PORTFOLIO: list[SearchConfiguration] = [
+    {'name': 'first', 'ordering': 'first'},
+    {'name': 'mrv', 'ordering': 'mrv'},
+    {'name': 'mrv-descending', 'ordering': 'mrv', 'value_ordering': 'descending'},
+    {'name': 'mrv-luby', 'ordering': 'mrv', 'seed': 1, 'restarts': 'luby'},
+]
+
+# Raises ValueError if a search configuration has an unknown setting or one that cannot finish
+
+
+def check_configuration(configuration: SearchConfiguration) -> None:
+    ordering = configuration.get('ordering', 'first')
+    if ordering not in ['first', 'mrv']:
+        raise ValueError(f"Unknown ordering '{ordering}'")
+    value_ordering = configuration.get('value_ordering', 'ascending')
+    if value_ordering not in ['ascending', 'descending']:
+        raise ValueError(f"Unknown value ordering '{value_ordering}'")
+    restarts = configuration.get('restarts', 'none')
+    if restarts not in ['none', 'luby', 'geometric']:
+        raise ValueError(f"Unknown restart policy '{restarts}'")
+    if restarts != 'none' and configuration.get('seed') is None:
+        raise ValueError("Restarts need a seed to vary the search")
+    # The failure limit has to keep growing, or a hard puzzle restarts forever
+    if configuration.get('restart_base', 100) < 1:
+        raise ValueError("Restart base must be at least 1")
+    if configuration.get('restart_factor', 1.5) <= 1:
+        raise ValueError("Restart factor must be greater than 1")
+
+# Returns the i-th term (starting at 1) of the Luby sequence: 1, 1, 2, 1, 1, 2, 4, 1, ...
+
+
+def luby(i: int) -> int:
+    k = 1
+    while (1 << k) - 1 < i:
+        k += 1
+    if i == (1 << k) - 1:
+        return 1 << (k - 1)
+    return luby(i - (1 << (k - 1)) + 1)
+
+# Raised inside the search when the failure limit for the current run is reached
+
+
+class RestartSearch(Exception):
+    pass
+
+# Saved progress of an exhaustive search
+# Path is the list of (position, value) choices leading to the node the search was working on
+# Digest is a fingerprint of the puzzle (domains and constraints), see CSP.get_digest
+# Done is set once the whole search has finished
+
+
+CHECKPOINT_VERSION = 2
+Checkpoint = TypedDict('Checkpoint', {
+    'version': int,
+    'digest': str,
+    'ordering': str,
+    'value_ordering': str,
+    'assignment': dict[int, int],
+    'path': list[tuple[int, int]],
+    'solutions': list[dict[int, int]],
+    'done': bool
+})
+
+# Writes a checkpoint as JSON
+# The file is replaced in one step, so a crash mid-write leaves the previous checkpoint intact
+
+
+def save_checkpoint(checkpoint_path: str, checkpoint: Checkpoint) -> None:
+    # Each process writes its own temporary file, so two jobs never write into the same one
+    temporary_path = f'{checkpoint_path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'w') as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+    os.replace(temporary_path, checkpoint_path)
+
+# Reads a checkpoint back, restoring the integer keys JSON turns into strings
+
+
+def load_checkpoint(checkpoint_path: str) -> Checkpoint:
+    with open(checkpoint_path) as checkpoint_file:
+        data = json.load(checkpoint_file)
+    if data.get('version') != CHECKPOINT_VERSION:
+        raise ValueError(
+            f"Checkpoint version {data.get('version')} is not supported")
+    return {
+        'version': data['version'],
+        'digest': data['digest'],
+        'ordering': data['ordering'],
+        'value_ordering': data['value_ordering'],
+        'assignment': {int(key): value for key, value in data['assignment'].items()},
+        'path': [(position, value) for position, value in data['path']],
+        'solutions': [{int(key): value for key, value in solution.items()}
+                      for solution in data['solutions']],
+        'done': data['done']
+    }
 
 # Base class as a parent of other constraint classes
 
@@ -19,6 +139,11 @@ class Constraint(ABC):
     def satisfied(self, assignment: dict[int, int]):
         pass
 
+    # Returns the settings that define the constraint, used to fingerprint a puzzle for checkpoints
+    # Constraints with more settings than their position extend this
+    def get_settings(self) -> dict:
+        return {'position': self.position}
+
 # Class to check for no duplicate numbers per column
 
 
@@ -34,9 +159,8 @@ class ColumnConstraint(Constraint):
         var_to_check = [x for x in range(var_col, 81, 9)]
         var_values: list[int] = []
         # Check that none of these vars have same assignment
-        assigned_vars = list(assignment.keys())
         for position in var_to_check:
-            if position in assigned_vars:
+            if position in assignment:
                 if assignment[position] in var_values:
                     return False
                 else:
@@ -61,9 +185,8 @@ class RowConstraint(Constraint):
         var_to_check = [x for x in range(var_row*9, ((var_row+1)*9))]
         var_values: list[int] = []
         # Check that none of these vars have same assignment
-        assigned_vars = list(assignment.keys())
         for position in var_to_check:
-            if position in assigned_vars:
+            if position in assignment:
                 if assignment[position] in var_values:
                     return False
                 else:
@@ -105,9 +228,8 @@ class SectorConstraint(Constraint):
             final_var_to_check.append(entry + 18)
         # Check that none of these vars have same assignment
         var_values: list[int] = []
-        assigned_vars = list(assignment.keys())
         for position in final_var_to_check:
-            if position in assigned_vars:
+            if position in assignment:
                 if assignment[position] in var_values:
                     return False
                 else:
@@ -117,6 +239,134 @@ class SectorConstraint(Constraint):
 
         return True
 
+# Class to check for no duplicate numbers on the diagonals (X-Sudoku)
+
+
+class DiagonalConstraint(Constraint):
+
+    def __init__(self, position: int):
+        super().__init__(position)
+        row_idx = math.floor(position / 9)
+        col_idx = position % 9
+        # List the positions of each diagonal this position sits on
+        self.diagonals: list[list[int]] = []
+        if row_idx == col_idx:
+            self.diagonals.append([x * 10 for x in range(0, 9)])
+        if row_idx + col_idx == 8:
+            self.diagonals.append([x * 8 for x in range(1, 10)])
+        if not self.diagonals:
+            raise LookupError("Position is not on a diagonal")
+
+    def satisfied(self, assignment: dict[int, int]) -> bool:
+        for diagonal in self.diagonals:
+            var_values: list[int] = []
+            for position in diagonal:
+                if position in assignment:
+                    if assignment[position] in var_values:
+                        return False
+                    else:
+                        var_values.append(assignment[position])
+        return True
+
+# Lists every set of distinct digits that adds up to each (cage size, total)
+# Each set is stored as a bitmask with digit d at bit d
+
+
+def get_cage_combinations() -> dict[tuple[int, int], list[int]]:
+    combinations: dict[tuple[int, int], list[int]] = {}
+    for cage_size in range(1, 10):
+        for digits in itertools.combinations(range(1, 10), cage_size):
+            combinations.setdefault((cage_size, sum(digits)), []).append(
+                sum(1 << digit for digit in digits))
+    return combinations
+
+
+CAGE_COMBINATIONS = get_cage_combinations()
+
+# Class to check a killer cage: distinct numbers adding up to a total
+# The numbers placed so far must fit one of the digit combinations for the cage,
+# so candidates are narrowed as soon as any cell of the cage is filled in (see CSP.consistent_values)
+
+
+class CageConstraint(Constraint):
+
+    def __init__(self, position: int, cells: list[int], total: int):
+        super().__init__(position)
+        if position not in cells:
+            raise LookupError("Position is not in the cage")
+        self.cells = cells
+        self.total = total
+        self.combinations = CAGE_COMBINATIONS.get((len(cells), total), [])
+
+    def get_settings(self) -> dict:
+        return {'position': self.position, 'cells': self.cells, 'total': self.total}
+
+    # Returns the bitmask of the numbers placed in the cage, or None if a number repeats
+    def placed_mask(self, assignment: dict[int, int]) -> int | None:
+        mask = 0
+        for position in self.cells:
+            if position in assignment:
+                bit = 1 << assignment[position]
+                if mask & bit:
+                    return None
+                mask |= bit
+        return mask
+
+    def satisfied(self, assignment: dict[int, int]) -> bool:
+        mask = self.placed_mask(assignment)
+        if mask is None:
+            return False
+        for combination in self.combinations:
+            if combination & mask == mask:
+                return True
+        return False
+
+    # Returns the numbers that could still go in the empty cells of the cage
+    def candidates(self, assignment: dict[int, int]) -> list[int]:
+        mask = self.placed_mask(assignment)
+        if mask is None:
+            return []
+        allowed = 0
+        for combination in self.combinations:
+            if combination & mask == mask:
+                allowed |= combination
+        allowed &= ~mask
+        return [value for value in range(1, 10) if allowed & (1 << value)]
+
+# Class to check a thermometer: numbers strictly increase from the bulb (first cell) along the cells
+
+
+class ThermometerConstraint(Constraint):
+
+    def __init__(self, position: int, cells: list[int]):
+        super().__init__(position)
+        if position not in cells:
+            raise LookupError("Position is not on the thermometer")
+        if len(cells) > 9:
+            raise ValueError("A thermometer can have at most 9 cells")
+        self.cells = cells
+
+    def get_settings(self) -> dict:
+        return {'position': self.position, 'cells': self.cells}
+
+    def satisfied(self, assignment: dict[int, int]) -> bool:
+        length = len(self.cells)
+        previous_idx = -1
+        previous_value = 0
+        for idx, position in enumerate(self.cells):
+            if position not in assignment:
+                continue
+            value = assignment[position]
+            # Leave room for the cells before and after this one
+            if value < idx + 1 or value > 9 - (length - 1 - idx):
+                return False
+            # Each step along the thermometer adds at least one
+            if previous_idx >= 0 and value - previous_value < idx - previous_idx:
+                return False
+            previous_idx = idx
+            previous_value = value
+        return True
+
 
 class CSP:
 
@@ -125,6 +375,27 @@ class CSP:
         self.positions = positions
         self.domains = domains
         self.constraints: dict[int, list[Constraint]] = {}
+        self.ordering = 'first'
+        self.value_ordering = 'ascending'
+        self.seed: int | None = None
+        self.restarts = 'none'
+        self.restart_base = 100
+        self.restart_factor = 1.5
+        # Random generator for tie-breaking, only set when a seed is given
+        self.random: random.Random | None = None
+        # Failures (dead ends) seen in the current run and the limit before a restart
+        self.failures = 0
+        self.failure_limit: int | None = None
+        # Counts how many times each configuration has won a portfolio race
+        self.portfolio_wins: dict[str, int] = {}
+        # State of an exhaustive search, see search_all
+        self.solutions: list[dict[int, int]] = []
+        self.resume_path: list[tuple[int, int]] = []
+        self.checkpoint_path: str | None = None
+        self.checkpoint_interval = 60.0
+        self.last_checkpoint = 0.0
+        self.digest = ''
+        self.initial_assignment: dict[int, int] = {}
 
         for position in self.positions:
             self.constraints[position] = []
@@ -138,7 +409,17 @@ class CSP:
         if constraint.position not in self.positions:
             raise LookupError("Position in constraint not in CSP")
         else:
-            self.constraints[position].append(constraint)
+            self.constraints[constraint.position].append(constraint)
+
+    # Sets how the search picks positions and values
+    def configure(self, configuration: SearchConfiguration) -> None:
+        check_configuration(configuration)
+        self.ordering = configuration.get('ordering', 'first')
+        self.value_ordering = configuration.get('value_ordering', 'ascending')
+        self.seed = configuration.get('seed')
+        self.restarts = configuration.get('restarts', 'none')
+        self.restart_base = configuration.get('restart_base', 100)
+        self.restart_factor = configuration.get('restart_factor', 1.5)
 
     # Checks if all position constraints have been satisfied
     def consistent(self, position: int, assignment: dict[int, int]) -> bool:
@@ -147,26 +428,449 @@ class CSP:
                 return False
         return True
 
-    # Recursive method responsible for solving the puzzle
+    # Returns the domain values of a position that satisfy its constraints
+    def consistent_values(self, position: int, assignment: dict[int, int]) -> list[int]:
+        domain = self.domains[position]
+        # A cage rules out whole digits at once, so they are not checked one by one against every constraint
+        for constraint in self.constraints[position]:
+            if isinstance(constraint, CageConstraint) and position not in assignment:
+                allowed = constraint.candidates(assignment)
+                domain = [value for value in domain if value in allowed]
+        local_assignment = assignment.copy()
+        values: list[int] = []
+        for value in domain:
+            local_assignment[position] = value
+            if self.consistent(position, local_assignment):
+                values.append(value)
+        return values
+
+    # Chooses the next position to fill in
+    def select_position(self, assignment: dict[int, int]) -> int:
+        # Get all positions that have not been assigned
+        unassigned = [v for v in self.positions if v not in assignment]
+        if self.ordering == 'first':
+            return unassigned[0]
+
+        # Pick the position with the fewest values left
+        best_positions = [unassigned[0]]
+        best_count = len(self.domains[unassigned[0]]) + 1
+        for position in unassigned:
+            count = len(self.consistent_values(position, assignment))
+            if count < best_count:
+                best_positions = [position]
+                best_count = count
+                # A position with one value left is forced, so there is nothing to break ties over
+                if count <= 1:
+                    break
+            elif count == best_count:
+                best_positions.append(position)
+        # Ties go to the first position unless the search is randomized
+        if self.random is not None:
+            return self.random.choice(best_positions)
+        return best_positions[0]
+
+    # Puts the domain values of a position in the order they should be tried
+    def order_values(self, position: int) -> list[int]:
+        values = list(self.domains[position])
+        if self.value_ordering == 'descending':
+            values.reverse()
+        if self.random is not None:
+            self.random.shuffle(values)
+        return values
+
+    # Solves the puzzle starting from the given assignment
+    # With a restart policy, each run is cut off after a number of failures and the search starts over
     def backtracking_search(self, assignment: dict[int, int]) -> dict[int, int] | None:
+        self.random = None if self.seed is None else random.Random(self.seed)
+        run = 1
+        while True:
+            self.failures = 0
+            if self.restarts == 'luby':
+                self.failure_limit = self.restart_base * luby(run)
+            elif self.restarts == 'geometric':
+                self.failure_limit = int(
+                    self.restart_base * self.restart_factor ** (run - 1))
+            else:
+                self.failure_limit = None
+            try:
+                return self.recursive_search(assignment)
+            except RestartSearch:
+                run += 1
+
+    # Recursive method responsible for solving the puzzle
+    def recursive_search(self, assignment: dict[int, int]) -> dict[int, int] | None:
         # Check if each position has an assignment. If so, stop
         if len(assignment) == len(self.positions):
             return assignment
 
-        # Get all positions that have not been assigned
-        unassigned = [v for v in self.positions if v not in assignment]
-
-        # Get every possible domain value of the first unassigned position
-        this_position = unassigned[0]
-        for value in self.domains[this_position]:
+        # Get every possible domain value of the next position
+        this_position = self.select_position(assignment)
+        for value in self.order_values(this_position):
             local_assignment = assignment.copy()
             local_assignment[this_position] = value
             # Check if constraints are satisfied.
             # If so, continue to recurse
             if self.consistent(this_position, local_assignment):
-                result = self.backtracking_search(local_assignment)
+                result = self.recursive_search(local_assignment)
                 if result is not None:
                     return result
+
+        # Dead end, so count a failure and restart once the limit is reached
+        self.failures += 1
+        if self.failure_limit is not None and self.failures >= self.failure_limit:
+            raise RestartSearch()
+        return None
+
+    # Returns a fingerprint of the puzzle: its domains and the type and settings of every constraint
+    # Used to make sure a checkpoint is only resumed on the puzzle it was made for
+    def get_digest(self) -> str:
+        constraints = []
+        for position in self.positions:
+            for constraint in self.constraints[position]:
+                constraints.append(
+                    [type(constraint).__name__, constraint.get_settings()])
+        contents = json.dumps({
+            'positions': self.positions,
+            'domains': [self.domains[position] for position in self.positions],
+            'constraints': constraints
+        }, sort_keys=True)
+        return hashlib.sha256(contents.encode()).hexdigest()
+
+    # Finds every solution starting from the given assignment
+    # With a checkpoint path, progress is written to that file every checkpoint_interval seconds
+    # Calling again with the same file picks the search up where the last run stopped
+    def search_all(self, assignment: dict[int, int], checkpoint_path: str | None = None, checkpoint_interval: float = 60.0) -> list[dict[int, int]]:
+        if self.seed is not None:
+            raise ValueError(
+                "A resumable search needs a fixed ordering, so it cannot use a seed")
+        self.random = None
+        self.failure_limit = None
+        self.solutions = []
+        self.resume_path = []
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self.last_checkpoint = time.monotonic()
+        self.initial_assignment = assignment
+        # The fingerprint is only needed to match the search to a checkpoint file
+        self.digest = '' if checkpoint_path is None else self.get_digest()
+
+        if checkpoint_path is not None and os.path.exists(checkpoint_path):
+            checkpoint = load_checkpoint(checkpoint_path)
+            if checkpoint['digest'] != self.digest:
+                raise ValueError(
+                    "Checkpoint was made for a different set of domains or constraints")
+            if checkpoint['assignment'] != assignment:
+                raise ValueError("Checkpoint was made for a different puzzle")
+            if checkpoint['ordering'] != self.ordering or checkpoint['value_ordering'] != self.value_ordering:
+                raise ValueError(
+                    "Checkpoint was made with a different search ordering")
+            self.solutions = checkpoint['solutions']
+            if checkpoint['done']:
+                return self.solutions
+            self.resume_path = checkpoint['path']
+
+        self.exhaustive_search(assignment, [])
+        if checkpoint_path is not None:
+            self.save_progress([], True)
+        return self.solutions
+
+    # Writes the current progress of search_all to its checkpoint file
+    def save_progress(self, path: list[tuple[int, int]], done: bool) -> None:
+        if self.checkpoint_path is None:
+            return
+        save_checkpoint(self.checkpoint_path, {
+            'version': CHECKPOINT_VERSION,
+            'digest': self.digest,
+            'ordering': self.ordering,
+            'value_ordering': self.value_ordering,
+            'assignment': self.initial_assignment,
+            'path': path,
+            'solutions': self.solutions,
+            'done': done
+        })
+        self.last_checkpoint = time.monotonic()
+
+    # Recursive method that visits every solution
+    # Path holds the (position, value) choices that led to this assignment
+    def exhaustive_search(self, assignment: dict[int, int], path: list[tuple[int, int]]) -> None:
+        # Once the checkpointed node is reached again, the search carries on as normal
+        if len(path) == len(self.resume_path):
+            self.resume_path = []
+        # Save progress before exploring this node, so a resumed run explores it again in full
+        if self.checkpoint_path is not None and not self.resume_path:
+            if time.monotonic() - self.last_checkpoint >= self.checkpoint_interval:
+                self.save_progress(path, False)
+
+        # Check if each position has an assignment. If so, record it
+        if len(assignment) == len(self.positions):
+            self.solutions.append(assignment)
+            return
+
+        this_position = self.select_position(assignment)
+        # When resuming, skip the values explored before the checkpoint
+        resume_choice = None
+        if self.resume_path:
+            resume_choice = self.resume_path[len(path)]
+            if resume_choice[0] != this_position:
+                raise ValueError("Checkpoint does not match this search")
+        for value in self.order_values(this_position):
+            if resume_choice is not None:
+                if value != resume_choice[1]:
+                    continue
+                resume_choice = None
+            local_assignment = assignment.copy()
+            local_assignment[this_position] = value
+            # Check if constraints are satisfied.
+            # If so, continue to recurse
+            if self.consistent(this_position, local_assignment):
+                self.exhaustive_search(
+                    local_assignment, path + [(this_position, value)])
+
+    # Races several differently configured searches in separate processes
+    # Returns the name of the first configuration to finish along with its result
+    # The other searches are stopped once an answer is in
+    def portfolio_search(self, assignment: dict[int, int], configurations: list[SearchConfiguration] | None = None, timeout: float | None = None) -> tuple[str, dict[int, int] | None]:
+        if configurations is None:
+            configurations = DEFAULT_PORTFOLIO
+        # Check every configuration up front, so a bad one cannot quietly drop out of the race
+        names: set[str] = set()
+        for configuration in configurations:
+            if 'name' not in configuration:
+                raise ValueError("Every portfolio configuration needs a name")
+            if configuration['name'] in names:
+                raise ValueError(
+                    f"Portfolio configuration name '{configuration['name']}' is used more than once")
+            names.add(configuration['name'])
+            check_configuration(configuration)
+        results: multiprocessing.Queue = multiprocessing.Queue()
+        processes: list[multiprocessing.Process] = []
+        for configuration in configurations:
+            process = multiprocessing.Process(
+                target=_portfolio_worker, args=(self, configuration, assignment, results), daemon=True)
+            process.start()
+            processes.append(process)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            while True:
+                try:
+                    name, solution, error = results.get(timeout=0.1)
+                    break
+                except queue.Empty:
+                    if not any(process.is_alive() for process in processes) and results.empty():
+                        raise RuntimeError(
+                            "Every search in the portfolio stopped without an answer")
+                    if deadline is not None and time.monotonic() > deadline:
+                        raise TimeoutError(
+                            "No search in the portfolio finished in time")
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+            for process in processes:
+                process.join()
+            results.close()
+
+        if error is not None:
+            raise RuntimeError(
+                f"Search '{name}' in the portfolio failed") from error
+        self.portfolio_wins[name] = self.portfolio_wins.get(name, 0) + 1
+        return name, solution
+
+# Runs one portfolio search and reports its result, or the error that stopped it, back to the parent process
+
+
+def _portfolio_worker(csp: CSP, configuration: SearchConfiguration, assignment: dict[int, int], results: multiprocessing.Queue) -> None:
+    try:
+        csp.configure(configuration)
+        solution = csp.backtracking_search(assignment)
+    except Exception as error:
+        results.put((configuration['name'], None, error))
+        return
+    results.put((configuration['name'], solution, None))
+
+# Lookup tables for the fast solver and SudokuSession
+# Digits are stored as bitmasks, with digit d at bit d
+
+
+ALL_DIGITS = 0b1111111110
+ROW_OF = [position // 9 for position in range(0, 81)]
+COL_OF = [position % 9 for position in range(0, 81)]
+SECTOR_OF = [(ROW_OF[position] // 3) * 3 + COL_OF[position] // 3
+             for position in range(0, 81)]
+# The 27 units (9 rows, 9 columns, 9 sectors), each a list of positions
+UNITS: list[list[int]] = (
+    [[position for position in range(0, 81) if ROW_OF[position] == idx] for idx in range(0, 9)] +
+    [[position for position in range(0, 81) if COL_OF[position] == idx] for idx in range(0, 9)] +
+    [[position for position in range(0, 81) if SECTOR_OF[position] == idx] for idx in range(0, 9)])
+# The 20 other positions that share a row, column or sector with each position
+PEERS: list[list[int]] = [
+    sorted(set(peer for unit in UNITS if position in unit for peer in unit) - {position})
+    for position in range(0, 81)]
+
+# Solves a classic sudoku using row, column and sector bitmasks
+# Always fills in the position with the fewest candidates next
+# Returns None if the assignment breaks a rule or cannot be completed
+
+
+def solve_grid(assignment: dict[int, int]) -> dict[int, int] | None:
+    rows = [0] * 9
+    cols = [0] * 9
+    sectors = [0] * 9
+    grid = [0] * 81
+    for position, value in assignment.items():
+        bit = 1 << value
+        row, col, sector = ROW_OF[position], COL_OF[position], SECTOR_OF[position]
+        if (rows[row] | cols[col] | sectors[sector]) & bit:
+            return None
+        rows[row] |= bit
+        cols[col] |= bit
+        sectors[sector] |= bit
+        grid[position] = value
+    empty = [position for position in range(0, 81) if grid[position] == 0]
+
+    def fill() -> bool:
+        # Find the empty position with the fewest candidates
+        best_position = -1
+        best_mask = 0
+        best_count = 10
+        for position in empty:
+            if grid[position]:
+                continue
+            mask = ALL_DIGITS & ~(rows[ROW_OF[position]] |
+                                  cols[COL_OF[position]] | sectors[SECTOR_OF[position]])
+            count = mask.bit_count()
+            if count < best_count:
+                best_position, best_mask, best_count = position, mask, count
+                if count <= 1:
+                    break
+        if best_position == -1:
+            return True
+
+        row, col, sector = ROW_OF[best_position], COL_OF[best_position], SECTOR_OF[best_position]
+        while best_mask:
+            bit = best_mask & -best_mask
+            best_mask ^= bit
+            rows[row] |= bit
+            cols[col] |= bit
+            sectors[sector] |= bit
+            grid[best_position] = bit.bit_length() - 1
+            if fill():
+                return True
+            rows[row] ^= bit
+            cols[col] ^= bit
+            sectors[sector] ^= bit
+            grid[best_position] = 0
+        return False
+
+    if not fill():
+        return None
+    return {position: grid[position] for position in range(0, 81)}
+
+# Keeps the state of one puzzle between moves, for interactive play
+# Placing or removing a number only updates the 20 peers of that position,
+# so candidates and conflicts never need the whole board to be rechecked
+
+
+class SudokuSession:
+
+    def __init__(self, assignment: dict[int, int] | None = None):
+        self.values: dict[int, int] = {}
+        # For each position, how many of its peers hold each digit
+        self.peer_counts: list[list[int]] = [[0] * 10 for _ in range(0, 81)]
+        # For each position, the digits held by at least one of its peers
+        self.blocked: list[int] = [0] * 81
+        # Last solution found, kept after a move that disagrees with it, since undoing the move makes it fit again
+        self.solution: dict[int, int] | None = None
+        # Whether the board can be completed, or None if it needs to be worked out again
+        self.solvable: bool | None = None
+        if assignment is not None:
+            for position, value in assignment.items():
+                self.place(position, value)
+
+    # Puts a number on the board, replacing whatever was there
+    def place(self, position: int, value: int) -> None:
+        if position < 0 or position > 80:
+            raise LookupError("Position not on the board")
+        if value < 1 or value > 9:
+            raise ValueError("Value must be between 1 and 9")
+        if position in self.values:
+            self.unplace(position)
+        self.values[position] = value
+        bit = 1 << value
+        for peer in PEERS[position]:
+            counts = self.peer_counts[peer]
+            counts[value] += 1
+            if counts[value] == 1:
+                self.blocked[peer] |= bit
+        # A move that agrees with the last solution keeps it valid
+        # An unsolvable board stays unsolvable when a number is added
+        if self.solvable and self.solution is not None and self.solution[position] != value:
+            self.solvable = None
+
+    # Takes a number off the board
+    def unplace(self, position: int) -> None:
+        if position not in self.values:
+            raise LookupError("Position has no number to remove")
+        value = self.values.pop(position)
+        bit = 1 << value
+        for peer in PEERS[position]:
+            counts = self.peer_counts[peer]
+            counts[value] -= 1
+            if counts[value] == 0:
+                self.blocked[peer] &= ~bit
+        # Removing a number keeps any solution valid, but may make an unsolvable board solvable
+        if self.solvable is False:
+            self.solvable = None
+
+    # Returns the numbers that could still go in a position without clashing with its peers
+    def candidates(self, position: int) -> list[int]:
+        mask = ALL_DIGITS & ~self.blocked[position]
+        return [value for value in range(1, 10) if mask & (1 << value)]
+
+    # Returns the positions whose number also appears in the same row, column or sector
+    def conflicts(self) -> list[int]:
+        return sorted(position for position, value in self.values.items()
+                      if self.peer_counts[position][value] > 0)
+
+    # Checks if the board can still be completed
+    # The last solution is tried first, which is enough after a wrong move has been undone
+    def is_solvable(self) -> bool:
+        if self.solvable is None:
+            if self.solution is not None and all(
+                    self.solution[position] == value for position, value in self.values.items()):
+                self.solvable = True
+            elif self.conflicts():
+                self.solvable = False
+            else:
+                solution = solve_grid(self.values)
+                if solution is not None:
+                    self.solution = solution
+                self.solvable = solution is not None
+        return self.solvable
+
+    # Returns a move the rules force, as (position, value), or None if there is none
+    # Checks for a position with one candidate left, then for a number with one place left in a unit
+    def next_forced_move(self) -> tuple[int, int] | None:
+        if self.conflicts():
+            return None
+        for position in range(0, 81):
+            if position not in self.values:
+                mask = ALL_DIGITS & ~self.blocked[position]
+                if mask.bit_count() == 1:
+                    return position, mask.bit_length() - 1
+        for unit in UNITS:
+            placed = 0
+            for position in unit:
+                if position in self.values:
+                    placed |= 1 << self.values[position]
+            for value in range(1, 10):
+                bit = 1 << value
+                if placed & bit:
+                    continue
+                places = [position for position in unit
+                          if position not in self.values and not self.blocked[position] & bit]
+                if len(places) == 1:
+                    return places[0], value
         return None
 
 
@@ -253,8 +957,10 @@ if __name__ == "__main__":
         csp.add_constraint(SectorConstraint(position))
 
     # Get solution
-    solution = csp.backtracking_search(assignment)
+    # The portfolio races several search configurations and keeps the first answer
+    winner, solution = csp.portfolio_search(assignment)
     if solution is None:
         print('No solution found')
     else:
         print_solution(solution)
+        print(f'Solved by {winner}')
@@ -1,7 +1,23 @@
+import os
+import tempfile
 import unittest
+from unittest import mock
 from sudoku_solver import sudoku_solver as suso
 
 
+# Constraint with a setting that cannot be written as JSON
+
+
+class AllowedValuesConstraint(suso.Constraint):
+
+    def __init__(self, position: int, allowed: set[int]):
+        super().__init__(position)
+        self.allowed = allowed
+
+    def satisfied(self, assignment: dict[int, int]) -> bool:
+        return self.position not in assignment or assignment[self.position] in self.allowed
+
+
 class TestSolver(unittest.TestCase):
 
     def test_column_constraint_satisfied(self):
@@ -132,6 +148,405 @@ class TestSolver(unittest.TestCase):
         constraint = suso.SectorConstraint(0)
         self.assertFalse(constraint.satisfied(assignment))
 
+    def make_csp(self) -> suso.CSP:
+        positions = list(range(0, 81))
+        domains = {}
+        for position in positions:
+            domains[position] = list(range(1, 10))
+        csp = suso.CSP(positions, domains)
+        for position in positions:
+            csp.add_constraint(suso.RowConstraint(position))
+            csp.add_constraint(suso.ColumnConstraint(position))
+            csp.add_constraint(suso.SectorConstraint(position))
+        return csp
+
+    def make_assignment(self) -> dict[int, int]:
+        puzzle_design = [
+            [2, 0, 0, 0, 8, 0, 0, 6, 0],
+            [0, 0, 0, 0, 0, 0, 0, 0, 0],
+            [0, 1, 0, 0, 7, 0, 3, 0, 0],
+            [0, 3, 0, 8, 4, 0, 0, 0, 6],
+            [0, 8, 0, 0, 1, 0, 0, 2, 0],
+            [0, 4, 0, 0, 0, 0, 0, 9, 0],
+            [1, 0, 0, 0, 0, 7, 0, 0, 9],
+            [5, 0, 0, 0, 6, 0, 0, 7, 0],
+            [0, 0, 0, 9, 0, 4, 0, 0, 0]
+        ]
+        assignment = {}
+        for row_idx in range(0, 9):
+            for col_idx in range(0, 9):
+                if puzzle_design[row_idx][col_idx] != 0:
+                    assignment[row_idx * 9 +
+                               col_idx] = puzzle_design[row_idx][col_idx]
+        return assignment
+
+    def assert_valid_solution(self, csp: suso.CSP, solution):
+        self.assertIsNotNone(solution)
+        self.assertEqual(len(solution), 81)
+        for position in range(0, 81):
+            self.assertTrue(csp.consistent(position, solution))
+
+    def test_backtracking_search_with_mrv_ordering(self):
+        csp = self.make_csp()
+        csp.configure({'ordering': 'mrv'})
+        solution = csp.backtracking_search(self.make_assignment())
+        self.assert_valid_solution(csp, solution)
+        self.assertEqual(solution[1], 5)
+
+    def test_configure_rejects_unknown_ordering(self):
+        csp = self.make_csp()
+        with self.assertRaises(ValueError):
+            csp.configure({'ordering': 'random'})
+
+    def test_portfolio_search_records_winner(self):
+        csp = self.make_csp()
+        winner, solution = csp.portfolio_search(self.make_assignment(), [
+            {'name': 'mrv', 'ordering': 'mrv'},
+            {'name': 'mrv-descending', 'ordering': 'mrv',
+                'value_ordering': 'descending'},
+        ])
+        self.assertIn(winner, ['mrv', 'mrv-descending'])
+        self.assertEqual(csp.portfolio_wins, {winner: 1})
+        self.assert_valid_solution(csp, solution)
+
+    def test_portfolio_search_times_out(self):
+        csp = self.make_csp()
+        with self.assertRaises(TimeoutError):
+            csp.portfolio_search(self.make_assignment(), [
+                {'name': 'first', 'ordering': 'first'}], timeout=0.2)
+
+    def test_portfolio_search_checks_configurations_first(self):
+        csp = self.make_csp()
+        for configurations in [
+                [{'name': 'mrv', 'ordering': 'mvr'}],
+                [{'ordering': 'mrv'}],
+                [{'name': 'mrv', 'ordering': 'mrv'}, {'name': 'mrv', 'ordering': 'first'}]]:
+            with self.assertRaises(ValueError):
+                csp.portfolio_search(self.make_assignment(), configurations)
+        self.assertEqual(csp.portfolio_wins, {})
+
+    # An error inside a search is sent back to the parent instead of being lost with the process
+    def test_portfolio_search_reports_worker_error(self):
+        csp = self.make_csp()
+        for position in [0, 1]:
+            csp.add_constraint(suso.CageConstraint(position, [0, 1], 7))
+        with self.assertRaises(RuntimeError) as context:
+            csp.portfolio_search({0: 'x'}, [{'name': 'first'}])
+        self.assertIsInstance(context.exception.__cause__, TypeError)
+
+    def test_luby_sequence(self):
+        self.assertEqual([suso.luby(i) for i in range(1, 16)], [
+                         1, 1, 2, 1, 1, 2, 4, 1, 1, 2, 1, 1, 2, 4, 8])
+
+    def test_configure_rejects_restarts_without_seed(self):
+        csp = self.make_csp()
+        with self.assertRaises(ValueError):
+            csp.configure({'restarts': 'luby'})
+
+    # A limit that shrinks or stays the same would restart forever on a hard puzzle
+    def test_configure_rejects_restart_factor_not_above_one(self):
+        csp = self.make_csp()
+        for restart_factor in [0.5, 1.0]:
+            with self.assertRaises(ValueError):
+                csp.configure({'seed': 1, 'restarts': 'geometric',
+                               'restart_factor': restart_factor})
+
+    def test_configure_rejects_restart_base_below_one(self):
+        csp = self.make_csp()
+        with self.assertRaises(ValueError):
+            csp.configure({'seed': 1, 'restarts': 'luby', 'restart_base': 0})
+
+    # The same seed must give the same search, restarts included
+    def test_randomized_search_is_reproducible(self):
+        configuration = {'ordering': 'mrv', 'seed': 7,
+                         'restarts': 'geometric', 'restart_base': 10,
+                         'restart_factor': 2.0}
+        first_csp = self.make_csp()
+        first_csp.configure(configuration)
+        first_solution = first_csp.backtracking_search(self.make_assignment())
+        second_csp = self.make_csp()
+        second_csp.configure(configuration)
+        second_solution = second_csp.backtracking_search(self.make_assignment())
+        self.assert_valid_solution(first_csp, first_solution)
+        self.assertEqual(first_solution, second_solution)
+        self.assertEqual(first_csp.failures, second_csp.failures)
+
+    def test_restart_limit_follows_luby_sequence(self):
+        csp = self.make_csp()
+        csp.configure({'ordering': 'mrv', 'seed': 3,
+                      'restarts': 'luby', 'restart_base': 1})
+        self.assert_valid_solution(csp, csp.backtracking_search(self.make_assignment()))
+        self.assertLess(csp.failures, csp.failure_limit)
+        self.assertIn(csp.failure_limit, [1, 2, 4, 8, 16, 32, 64, 128, 256])
+
+    # Solved grid with the top row and a swappable rectangle of 3s and 4s removed
+    # This leaves exactly two solutions
+    def make_two_solution_assignment(self) -> dict[int, int]:
+        solved_rows = ['257483961', '368591742', '419672358',
+                       '732849516', '985716423', '641235897',
+                       '124357689', '593168274', '876924135']
+        removed = list(range(0, 9)) + [28, 31, 46, 49]
+        assignment = {}
+        for row_idx in range(0, 9):
+            for col_idx in range(0, 9):
+                position = row_idx * 9 + col_idx
+                if position not in removed:
+                    assignment[position] = int(solved_rows[row_idx][col_idx])
+        return assignment
+
+    def test_search_all_finds_every_solution(self):
+        csp = self.make_csp()
+        solutions = csp.search_all(self.make_two_solution_assignment())
+        self.assertEqual(len(solutions), 2)
+        self.assertEqual(sorted(solution[28] for solution in solutions), [3, 4])
+        for solution in solutions:
+            self.assert_valid_solution(csp, solution)
+
+    def test_search_all_resumes_from_checkpoint(self):
+        assignment = self.make_two_solution_assignment()
+        expected = self.make_csp().search_all(assignment)
+
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint_path = os.path.join(directory, 'search.json')
+            # Stop the first run after it has found one solution, as if the process had been killed
+            interrupted_csp = self.make_csp()
+            save_progress = interrupted_csp.save_progress
+            saves = []
+
+            def interrupt(path, done):
+                save_progress(path, done)
+                saves.append(path)
+                if len(saves) == 17:
+                    raise KeyboardInterrupt()
+            interrupted_csp.save_progress = interrupt
+            with self.assertRaises(KeyboardInterrupt):
+                interrupted_csp.search_all(
+                    assignment, checkpoint_path, checkpoint_interval=0)
+            checkpoint = suso.load_checkpoint(checkpoint_path)
+            self.assertFalse(checkpoint['done'])
+            self.assertEqual(len(checkpoint['solutions']), 1)
+
+            resumed = self.make_csp().search_all(
+                assignment, checkpoint_path, checkpoint_interval=0)
+            self.assertEqual(resumed, expected)
+            self.assertTrue(suso.load_checkpoint(checkpoint_path)['done'])
+
+            # A finished checkpoint just returns its solutions
+            self.assertEqual(self.make_csp().search_all(
+                assignment, checkpoint_path), expected)
+
+    def test_search_all_rejects_checkpoint_for_other_puzzle(self):
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint_path = os.path.join(directory, 'search.json')
+            self.make_csp().search_all(
+                self.make_two_solution_assignment(), checkpoint_path)
+            with self.assertRaises(ValueError):
+                self.make_csp().search_all({0: 2}, checkpoint_path)
+
+    def test_search_all_rejects_checkpoint_for_other_constraints(self):
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint_path = os.path.join(directory, 'search.json')
+            self.make_csp().search_all(
+                self.make_two_solution_assignment(), checkpoint_path)
+            # Same givens, with a killer cage added
+            csp = self.make_csp()
+            for position in [0, 1]:
+                csp.add_constraint(suso.CageConstraint(position, [0, 1], 7))
+            with self.assertRaises(ValueError):
+                csp.search_all(
+                    self.make_two_solution_assignment(), checkpoint_path)
+
+    def test_search_all_with_constraint_settings_that_are_not_json(self):
+        csp = self.make_csp()
+        csp.add_constraint(AllowedValuesConstraint(0, set(range(1, 10))))
+        self.assertEqual(
+            len(csp.search_all(self.make_two_solution_assignment())), 2)
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint_path = os.path.join(directory, 'search.json')
+            self.assertEqual(len(csp.search_all(
+                self.make_two_solution_assignment(), checkpoint_path)), 2)
+
+    def test_search_all_rejects_seed(self):
+        csp = self.make_csp()
+        csp.configure({'seed': 1})
+        with self.assertRaises(ValueError):
+            csp.search_all(self.make_two_solution_assignment())
+
+    def test_solve_grid(self):
+        solution = suso.solve_grid(self.make_assignment())
+        self.assert_valid_solution(self.make_csp(), solution)
+        self.assertEqual(solution[1], 5)
+
+    def test_solve_grid_with_clashing_numbers(self):
+        self.assertIsNone(suso.solve_grid({0: 1, 1: 1}))
+
+    def test_session_candidates(self):
+        session = suso.SudokuSession({0: 1, 10: 2, 72: 3})
+        self.assertEqual(session.candidates(9), [4, 5, 6, 7, 8, 9])
+
+    def test_session_unplace_restores_candidates(self):
+        session = suso.SudokuSession({0: 1})
+        session.unplace(0)
+        self.assertEqual(session.candidates(1), list(range(1, 10)))
+
+    def test_session_conflicts(self):
+        session = suso.SudokuSession({0: 1, 8: 1, 40: 5})
+        self.assertEqual(session.conflicts(), [0, 8])
+        session.place(8, 2)
+        self.assertEqual(session.conflicts(), [])
+
+    def test_session_next_forced_move(self):
+        session = suso.SudokuSession(self.make_assignment())
+        position, value = session.next_forced_move()
+        self.assertEqual(suso.solve_grid(self.make_assignment())[position], value)
+
+    def test_session_is_solvable_after_moves(self):
+        session = suso.SudokuSession(self.make_assignment())
+        self.assertTrue(session.is_solvable())
+        # Correct move from the known answer
+        session.place(1, 5)
+        self.assertTrue(session.is_solvable())
+        # Wrong move with no direct clash
+        session.place(2, 9)
+        self.assertEqual(session.conflicts(), [])
+        self.assertFalse(session.is_solvable())
+        session.unplace(2)
+        self.assertTrue(session.is_solvable())
+
+    # Undoing a wrong move makes the last solution fit again, so no new search is needed
+    def test_session_keeps_solution_across_wrong_move_and_undo(self):
+        session = suso.SudokuSession(self.make_assignment())
+        self.assertTrue(session.is_solvable())
+        with mock.patch.object(suso, 'solve_grid', wraps=suso.solve_grid) as solve_grid:
+            session.place(2, 9)
+            self.assertFalse(session.is_solvable())
+            session.unplace(2)
+            self.assertTrue(session.is_solvable())
+        self.assertEqual(solve_grid.call_count, 1)
+
+    def test_session_rejects_position_off_board(self):
+        session = suso.SudokuSession()
+        with self.assertRaises(LookupError):
+            session.place(81, 1)
+
+    def test_diagonal_constraint_satisfied(self):
+        assignment = {
+            0: 1,
+            10: 2,
+            40: 3,
+            8: 4,
+            16: 5
+        }
+
+        constraint = suso.DiagonalConstraint(40)
+        self.assertTrue(constraint.satisfied(assignment))
+
+    def test_diagonal_constraint_unsatisfied(self):
+        assignment = {
+            8: 1,
+            40: 3,
+            72: 1
+        }
+
+        constraint = suso.DiagonalConstraint(40)
+        self.assertFalse(constraint.satisfied(assignment))
+
+    def test_diagonal_constraint_off_diagonal(self):
+        with self.assertRaises(LookupError):
+            suso.DiagonalConstraint(1)
+
+    def test_cage_combinations(self):
+        # 1 + 2 + 4 is the only way to make 7 from three digits
+        self.assertEqual(suso.CAGE_COMBINATIONS[(3, 7)], [0b10110])
+        self.assertEqual(len(suso.CAGE_COMBINATIONS[(2, 10)]), 4)
+
+    def test_cage_constraint_satisfied_with_incomplete_cage(self):
+        assignment = {
+            0: 1
+        }
+
+        constraint = suso.CageConstraint(0, [0, 1, 2], 7)
+        self.assertTrue(constraint.satisfied(assignment))
+
+    # 3 can never be part of a three digit cage adding up to 7
+    def test_cage_constraint_unsatisfied_before_cage_is_full(self):
+        assignment = {
+            0: 3
+        }
+
+        constraint = suso.CageConstraint(0, [0, 1, 2], 7)
+        self.assertFalse(constraint.satisfied(assignment))
+
+    def test_cage_constraint_unsatisfied_with_repeat(self):
+        assignment = {
+            0: 4,
+            1: 4
+        }
+
+        constraint = suso.CageConstraint(0, [0, 1], 8)
+        self.assertFalse(constraint.satisfied(assignment))
+
+    def test_cage_constraint_candidates(self):
+        assignment = {
+            0: 9
+        }
+
+        constraint = suso.CageConstraint(0, [0, 1, 2], 20)
+        self.assertEqual(constraint.candidates(assignment), [3, 4, 5, 6, 7, 8])
+        self.assertEqual(constraint.candidates({0: 9, 1: 8}), [3])
+
+    # The search narrows a cage cell to the numbers that can still complete the cage
+    def test_consistent_values_uses_cage_candidates(self):
+        csp = self.make_csp()
+        for position in [0, 1, 2]:
+            csp.add_constraint(suso.CageConstraint(position, [0, 1, 2], 20))
+        self.assertEqual(csp.consistent_values(1, {0: 9}), [3, 4, 5, 6, 7, 8])
+        self.assertEqual(csp.consistent_values(2, {0: 9, 1: 8}), [3])
+
+    def test_thermometer_constraint_satisfied(self):
+        assignment = {
+            0: 2,
+            2: 5
+        }
+
+        constraint = suso.ThermometerConstraint(0, [0, 1, 2])
+        self.assertTrue(constraint.satisfied(assignment))
+
+    # There is no room for a number between 2 and 3
+    def test_thermometer_constraint_unsatisfied_without_room(self):
+        assignment = {
+            0: 2,
+            2: 3
+        }
+
+        constraint = suso.ThermometerConstraint(0, [0, 1, 2])
+        self.assertFalse(constraint.satisfied(assignment))
+
+    # The bulb of a three cell thermometer cannot hold more than 7
+    def test_thermometer_constraint_unsatisfied_at_bulb(self):
+        assignment = {
+            0: 8
+        }
+
+        constraint = suso.ThermometerConstraint(0, [0, 1, 2])
+        self.assertFalse(constraint.satisfied(assignment))
+
+    def test_backtracking_search_with_cages_and_thermometer(self):
+        csp = self.make_csp()
+        cages = [([0, 1], 7), ([2, 3], 11)]
+        for cells, total in cages:
+            for position in cells:
+                csp.add_constraint(suso.CageConstraint(position, cells, total))
+        thermometer = [0, 9, 18]
+        for position in thermometer:
+            csp.add_constraint(suso.ThermometerConstraint(position, thermometer))
+        csp.configure({'ordering': 'mrv'})
+        assignment = self.make_assignment()
+        del assignment[0]
+        solution = csp.backtracking_search(assignment)
+        self.assert_valid_solution(csp, solution)
+        self.assertEqual(solution[0] + solution[1], 7)
+
 
 if __name__ == '__main__':
     unittest.main()